@@ -0,0 +1,156 @@
+import numpy as np
+
+# Doc ids are split into chunks of 2^16 by their high bits. A chunk holding at most ARRAY_MAX ids is an array
+# container (sorted uint16 low bits); a denser chunk is a bitmap container (1024 uint64 words, one bit per
+# low value). Both take at most 8 KiB, so the choice always keeps the smaller one.
+CHUNK_BITS = 16
+ARRAY_MAX = 4096
+
+
+def is_bitmap(container):
+    return container.dtype == np.uint64
+
+
+def to_bitmap(container):
+    if is_bitmap(container):
+        return container
+    bits = np.zeros(1 << CHUNK_BITS, dtype=bool)
+    bits[container] = True
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+def to_values(container):
+    # Sorted uint16 low bits of a container
+    if not is_bitmap(container):
+        return container
+    return np.flatnonzero(np.unpackbits(container.view(np.uint8), bitorder='little')).astype(np.uint16)
+
+
+def cardinality(container):
+    if not is_bitmap(container):
+        return len(container)
+    return int(np.unpackbits(container.view(np.uint8)).sum())
+
+
+def contains(words, values):
+    # Mask of the values whose bit is set in a bitmap container
+    return (words[values >> 6] >> (values & 63).astype(np.uint64)) & np.uint64(1) == 1
+
+
+def shrink(container):
+    """ Returns a bitmap container as an array container once it holds ARRAY_MAX ids or fewer, None if empty
+    """
+    count = cardinality(container)
+    if count == 0:
+        return None
+    if is_bitmap(container) and count <= ARRAY_MAX:
+        return to_values(container)
+    return container
+
+
+def and_containers(a, b):
+    if is_bitmap(a) and is_bitmap(b):
+        return shrink(a & b)
+    if is_bitmap(a):
+        a, b = b, a
+    if is_bitmap(b):
+        return shrink(a[contains(b, a)])
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return None
+    # Binary search of the smaller array in the larger one, O(|a| log |b|)
+    found = np.searchsorted(b, a)
+    found[found == len(b)] = 0
+    return shrink(a[b[found] == a])
+
+
+def or_containers(a, b):
+    if not is_bitmap(a) and not is_bitmap(b) and len(a) + len(b) <= ARRAY_MAX:
+        return np.union1d(a, b).astype(np.uint16)
+    return shrink(to_bitmap(a) | to_bitmap(b))
+
+
+def andnot_containers(a, b):
+    if is_bitmap(a):
+        return shrink(a & ~to_bitmap(b))
+    if is_bitmap(b):
+        return shrink(a[~contains(b, a)])
+    return shrink(np.setdiff1d(a, b, assume_unique=True).astype(np.uint16))
+
+
+class Bitmap:
+    """ Compressed set of int doc ids in the style of roaring bitmaps: {high bits: container}, where a
+    container is an array container for a sparse chunk or a bitmap container for a dense one. and/or/andnot
+    work chunk by chunk on NumPy arrays
+    """
+    def __init__(self, containers=None):
+        self.containers = containers if containers is not None else {}
+
+    @classmethod
+    def from_ids(cls, doc_ids):
+        """ This function builds a bitmap
+        inputs:
+        doc_ids - sorted int doc ids
+        outputs:
+        output - Bitmap
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        highs = doc_ids >> CHUNK_BITS
+        lows = (doc_ids & ((1 << CHUNK_BITS) - 1)).astype(np.uint16)
+        keys, starts = np.unique(highs, return_index=True)
+        ends = np.append(starts[1:], len(doc_ids))
+        containers = {}
+        for key, start, end in zip(keys.tolist(), starts.tolist(), ends.tolist()):
+            container = lows[start:end]
+            containers[key] = to_bitmap(container) if len(container) > ARRAY_MAX else container
+        return cls(containers)
+
+    def __bool__(self):
+        # Empty containers are never kept
+        return bool(self.containers)
+
+    def __len__(self):
+        return sum(cardinality(container) for container in self.containers.values())
+
+    def __iter__(self):
+        return iter(self.to_array().tolist())
+
+    def __eq__(self, other):
+        return isinstance(other, Bitmap) and np.array_equal(self.to_array(), other.to_array())
+
+    def to_array(self):
+        """ Returns the sorted doc ids as an int64 array
+        """
+        if not self.containers:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([(key << CHUNK_BITS) + to_values(self.containers[key]).astype(np.int64)
+                               for key in sorted(self.containers)])
+
+    def __and__(self, other):
+        containers = {}
+        for key in self.containers.keys() & other.containers.keys():
+            container = and_containers(self.containers[key], other.containers[key])
+            if container is not None:
+                containers[key] = container
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for key, container in other.containers.items():
+            containers[key] = or_containers(containers[key], container) if key in containers else container
+        return Bitmap(containers)
+
+    def andnot(self, other):
+        """ Returns the ids of self that are not in other
+        """
+        containers = {}
+        for key, container in self.containers.items():
+            if key in other.containers:
+                container = andnot_containers(container, other.containers[key])
+            if container is not None:
+                containers[key] = container
+        return Bitmap(containers)
+
+    def __sub__(self, other):
+        return self.andnot(other)
@@ -0,0 +1,35 @@
+import random
+import numpy as np
+from bitmap import Bitmap, is_bitmap, ARRAY_MAX
+
+
+def random_ids(rng, count, limit):
+    return np.array(sorted(rng.sample(range(limit), count)), dtype=np.int64)
+
+
+def test_from_ids():
+    doc_ids = np.array([3, 70000, 70001, 200000], dtype=np.int64)
+    bitmap = Bitmap.from_ids(doc_ids)
+    assert sorted(bitmap.containers) == [0, 1, 3]
+    assert bitmap.to_array().tolist() == doc_ids.tolist()
+    assert len(bitmap) == 4 and list(bitmap) == doc_ids.tolist()
+    dense = Bitmap.from_ids(np.arange(0, 60000, 2))
+    assert is_bitmap(dense.containers[0]) and len(dense) == 30000
+    assert len(Bitmap.from_ids([])) == 0 and Bitmap.from_ids([]).to_array().tolist() == []
+
+
+def test_operations():
+    rng = random.Random(5)
+    # Sparse and dense chunks on both sides
+    sets = [np.concatenate([random_ids(rng, count, 1 << 16), (1 << 16) + random_ids(rng, other, 1 << 16)])
+            for count, other in ((10, 20000), (30000, 50), (ARRAY_MAX, ARRAY_MAX + 1))]
+    for a in sets:
+        for b in sets:
+            bitmap_a, bitmap_b = Bitmap.from_ids(a), Bitmap.from_ids(b)
+            assert (bitmap_a & bitmap_b).to_array().tolist() == np.intersect1d(a, b).tolist()
+            assert (bitmap_a | bitmap_b).to_array().tolist() == np.union1d(a, b).tolist()
+            assert bitmap_a.andnot(bitmap_b).to_array().tolist() == np.setdiff1d(a, b).tolist()
+            # Results keep every container in its smallest form
+            for container in (bitmap_a & bitmap_b).containers.values():
+                assert is_bitmap(container) == (len(Bitmap({0: container})) > ARRAY_MAX)
+    assert Bitmap.from_ids([1, 2]) - Bitmap.from_ids([1, 2]) == Bitmap()
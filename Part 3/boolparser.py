@@ -1,73 +1,114 @@
 # Create an AST from a boolean expression. AST is a tuple
 # consisting of an operator and a list of operands.
-#
-# Note: NOT is not supported.
 
 # Example:
 #   given a AND b
 #   returns ('AND', ['a','b'])
 #
-# Copyright 2006, by Paul McGuir
-# Modified: 02/2011 for csci1580
-# Modified: 02/2018 for data2040
+# Operators are upper case. NOT binds tighter than AND, AND tighter than OR,
+# and a chain of the same operator gives one node:
+#   given a OR b AND "c d" AND (e OR f)
+#   returns ('OR', ['a', ('AND', ['b', '"c d"', ('OR', ['e', 'f'])])])
+# NOT takes one operand:
+#   given a AND NOT b
+#   returns ('AND', ['a', ('NOT', ['b'])])
+# An expression without operators is returned as its operand.
+#
+# Originally built with pyparsing's operatorPrecedence (Paul McGuire, 2006),
+# modified 02/2011 for csci1580 and 02/2018 for data2040.
+# boolparser_bench.py compares this parser with that grammar.
 
+import re
 from typing import Union
 
-import pyparsing
-
-
-class BoolOperand(object):
-    reprsymbol = None
-
-    def __init__(self, t):
-        self.args = t[0][0::2]
-
-    def __str__(self):
-        sep = " %s " % self.reprsymbol
-        return "(" + sep.join(map(str, self.args)) + ")"
-
-    def eval_expr(self):
-        raise NotImplementedError
-
-
-class BoolAnd(BoolOperand):
-    reprsymbol = 'AND'
-
-    def eval_expr(self):
-        lst = []
-        for arg in self.args:
-            if not isinstance(arg, BoolOperand):
-                elem = arg
-            else:
-                elem = arg.eval_expr()
-            lst.append(elem)
-        return self.reprsymbol, lst
-
-
-class BoolOr(BoolOperand):
-    reprsymbol = 'OR'
-
-    def eval_expr(self):
-        lst = []
-        for arg in self.args:
-            if not isinstance(arg, BoolOperand):
-                elem = arg
-            else:
-                elem = arg.eval_expr()
-            lst.append(elem)
-        return self.reprsymbol, lst
-
-
-BOOL_OPERAND = pyparsing.Word(pyparsing.alphanums +
-                              "!#$%&'*+,-./:;<=>?@[]^_`{|}~\\")
-OP_LIST = [("AND", 2, pyparsing.opAssoc.LEFT, BoolAnd),
-           ("OR", 2, pyparsing.opAssoc.LEFT, BoolOr)]
-BOOL_EXPR = pyparsing.operatorPrecedence(BOOL_OPERAND, OP_LIST)
+from cache import LRUCache
+
+OPERATORS = ('AND', 'OR', 'NOT')
+# A quoted phrase, a parenthesis, or a run of anything else
+TOKEN = re.compile(r'"[^"]*"|[()]|[^\s()"]+')
+
+# Parsed expressions by query string. The ASTs are shared: callers must not modify them
+ast_cache = LRUCache(1024)
+
+
+def tokenize(expr: str) -> list:
+    tokens = TOKEN.findall(expr)
+    if expr.count('"') % 2:
+        raise ValueError('unbalanced quote')
+    return tokens
+
+
+class Parser(object):
+    """ Recursive descent parser, one method per precedence level:
+        expr := and_expr ('OR' and_expr)*
+        and_expr := not_expr ('AND' not_expr)*
+        not_expr := 'NOT' not_expr | atom
+        atom := '(' expr ')' | phrase | word
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        ast = self.expr()
+        if self.peek() is not None:
+            raise ValueError("unexpected '%s'" % self.peek())
+        return ast
+
+    def chain(self, operator, operand):
+        operands = [operand()]
+        while self.peek() == operator:
+            self.take()
+            operands.append(operand())
+        return operands[0] if len(operands) == 1 else (operator, operands)
+
+    def expr(self):
+        return self.chain('OR', self.and_expr)
+
+    def and_expr(self):
+        return self.chain('AND', self.not_expr)
+
+    def not_expr(self):
+        if self.peek() == 'NOT':
+            self.take()
+            return 'NOT', [self.not_expr()]
+        return self.atom()
+
+    def atom(self):
+        token = self.take()
+        if token is None:
+            raise ValueError('missing operand')
+        if token == '(':
+            ast = self.expr()
+            if self.take() != ')':
+                raise ValueError("missing ')'")
+            return ast
+        if token == ')' or token in OPERATORS:
+            raise ValueError("unexpected '%s'" % token)
+        return token
+
+
+def positive_operands(ast: Union[str, tuple]) -> list:
+    # Operands of the AST that are not under a NOT, in query order
+    if isinstance(ast, str):
+        return [ast]
+    if ast[0] == 'NOT':
+        return []
+    return [operand for element in ast[1] for operand in positive_operands(element)]
 
 
 def bool_expr_ast(expr: str) -> Union[str, tuple]:
     expr = expr.strip()
-    parsed_expr = BOOL_EXPR.parseString(expr)[0]
-    if not isinstance(parsed_expr, BoolOperand):
-        return expr
-    return parsed_expr.eval_expr()
+    ast = ast_cache.get(expr)
+    if ast is None:
+        ast = Parser(tokenize(expr)).parse()
+        ast_cache.put(expr, ast)
+    return ast
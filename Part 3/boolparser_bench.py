@@ -0,0 +1,97 @@
+import argparse
+import time
+import boolparser
+
+# Boolean queries parsed when no query file is given
+QUERIES = ['dan AND potter', 'potters AND dan', 'dory OR neom', '(nemo AND dory) OR finding',
+           'hello OR find AND nemo', '(space AND odyssey) OR (clockwork AND (orange OR glory)) OR kubrick',
+           'a AND b AND c AND d AND e OR f']
+
+
+def pyparsing_parser():
+    """ This function builds the pyparsing grammar boolparser used to be, operatorPrecedence with AND over OR
+    outputs:
+    output - function expression string -> AST
+    """
+    import pyparsing
+
+    class BoolOperand(object):
+        def __init__(self, t):
+            self.args = t[0][0::2]
+
+        def eval_expr(self):
+            return self.reprsymbol, [arg.eval_expr() if isinstance(arg, BoolOperand) else arg for arg in self.args]
+
+    class BoolAnd(BoolOperand):
+        reprsymbol = 'AND'
+
+    class BoolOr(BoolOperand):
+        reprsymbol = 'OR'
+
+    operand = pyparsing.Word(pyparsing.alphanums + "!#$%&'*+,-./:;<=>?@[]^_`{|}~\\")
+    grammar = pyparsing.operatorPrecedence(operand, [("AND", 2, pyparsing.opAssoc.LEFT, BoolAnd),
+                                                     ("OR", 2, pyparsing.opAssoc.LEFT, BoolOr)])
+
+    def parse(expr):
+        expr = expr.strip()
+        parsed_expr = grammar.parseString(expr)[0]
+        if not isinstance(parsed_expr, BoolOperand):
+            return expr
+        return parsed_expr.eval_expr()
+    return parse
+
+
+def throughput(parse, queries, repeat):
+    # Parsed queries per second
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            parse(query)
+    return repeat * len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the parse throughput of boolparser with the pyparsing '
+                                                 'grammar it replaced')
+    parser.add_argument('--queries', help='file with one query per line; the Boolean ones are parsed')
+    parser.add_argument('--repeat', type=int, default=200, help='passes over the queries')
+    args = parser.parse_args()
+
+    queries = QUERIES
+    if args.queries:
+        with open(args.queries, 'r') as f:
+            queries = [line.strip() for line in f if 'AND' in line or 'OR' in line]
+
+    start = time.perf_counter()
+    legacy = pyparsing_parser()
+    print('pyparsing import and grammar: %.1f ms' % ((time.perf_counter() - start) * 1000))
+    import pyparsing
+    valid = []
+    # The old grammar has no NOT and no phrases: the queries it rejects are left out of its throughput
+    legacy_queries = []
+    for query in queries:
+        try:
+            ast = boolparser.bool_expr_ast(query)
+        except ValueError as e:
+            print('not a Boolean expression: %r (%s)' % (query, e))
+            continue
+        valid.append(query)
+        try:
+            legacy_ast = legacy(query)
+        except pyparsing.ParseException as e:
+            print('not supported by pyparsing: %r (%s)' % (query, e))
+            continue
+        legacy_queries.append(query)
+        if legacy_ast != ast:
+            print('different AST for %r: %r / %r' % (query, legacy_ast, ast))
+    queries = valid
+
+    print('pyparsing: %.0f queries/s (%d of %d queries)' % (throughput(legacy, legacy_queries, args.repeat),
+                                                             len(legacy_queries), len(queries)))
+    print('boolparser: %.0f queries/s' % throughput(
+        lambda query: boolparser.Parser(boolparser.tokenize(query.strip())).parse(), queries, args.repeat))
+    print('boolparser, cached: %.0f queries/s' % throughput(boolparser.bool_expr_ast, queries, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
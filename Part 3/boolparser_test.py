@@ -0,0 +1,33 @@
+import pytest
+import boolparser
+from boolparser import bool_expr_ast
+
+
+def test_bool_expr_ast():
+    assert bool_expr_ast('a AND b') == ('AND', ['a', 'b'])
+    assert bool_expr_ast(' nemo ') == 'nemo'
+    assert bool_expr_ast('a AND b AND c') == ('AND', ['a', 'b', 'c'])
+    # AND binds tighter than OR, parentheses nest
+    assert bool_expr_ast('hello OR find AND nemo') == ('OR', ['hello', ('AND', ['find', 'nemo'])])
+    assert bool_expr_ast('(nemo AND dory) OR finding') == ('OR', [('AND', ['nemo', 'dory']), 'finding'])
+    assert bool_expr_ast('(a AND b) AND c') == ('AND', [('AND', ['a', 'b']), 'c'])
+    assert bool_expr_ast('"toy story" AND (buzz OR woody)') == ('AND', ['"toy story"', ('OR', ['buzz', 'woody'])])
+    assert bool_expr_ast('NOT a AND b') == ('AND', [('NOT', ['a']), 'b'])
+    assert bool_expr_ast("rock'n'roll AND ANDROID") == ('AND', ["rock'n'roll", 'ANDROID'])
+
+
+@pytest.mark.parametrize('expr', ['AND', 'a AND', 'a b', '(a OR b', 'a OR b)', '"a b AND c', 'NOT', '()'])
+def test_bool_expr_ast_errors(expr):
+    with pytest.raises(ValueError):
+        bool_expr_ast(expr)
+
+
+def test_positive_operands():
+    ast = bool_expr_ast('(nemo OR "toy story") AND NOT (dory OR NOT woody) AND NOT fish')
+    assert boolparser.positive_operands(ast) == ['nemo', '"toy story"']
+
+
+def test_ast_cache():
+    ast = bool_expr_ast('dan AND potter')
+    assert bool_expr_ast('dan AND potter  ') is ast
+    assert boolparser.ast_cache.get('dan AND potter') is ast
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from nltk.stem import PorterStemmer
+
+
+class LRUCache:
+    """ Bounded mapping that evicts the least recently used entry once it holds maxsize entries. get counts
+    its hits and misses
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def items(self):
+        return self.entries.items()
+
+    def clear(self):
+        self.entries.clear()
+
+
+class StemCache(LRUCache):
+    """ Memoizes PorterStemmer.stem for the indexer and the query parser. With track_new, surface forms
+    stemmed since the last call to drain are remembered, so worker processes can send them back to the parent
+    """
+    def __init__(self, maxsize=2**19, track_new=False):
+        super().__init__(maxsize)
+        self.stemmer = PorterStemmer()
+        self.track_new = track_new
+        self.new_stems = []
+
+    def stem(self, word):
+        output = self.get(word)
+        if output is None:
+            output = self.stemmer.stem(word)
+            self.put(word, output)
+            if self.track_new:
+                self.new_stems.append((word, output))
+        return output
+
+    def drain(self):
+        """ Returns the (surface, stem) pairs computed since the last call and forgets them
+        """
+        output = self.new_stems
+        self.new_stems = []
+        return output
+
+    def update(self, pairs):
+        for word, stem in pairs:
+            self.put(word, stem)
+
+    def save(self, path):
+        """ Writes the surface -> stem table, one "surface stem" pair per line
+        """
+        with open(path, "w") as f:
+            for word, stem in self.items():
+                f.write(word + ' ' + stem + '\n')
+
+    def load(self, path):
+        with open(path, "r") as f:
+            for line in f:
+                split_line = line.split()
+                if len(split_line) == 2:
+                    self.put(split_line[0], split_line[1])
@@ -0,0 +1,37 @@
+from cache import LRUCache, StemCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 0)
+    assert cache.get('b') is None and cache.misses == 1
+
+
+def test_stem_cache_drain():
+    cache = StemCache(maxsize=10)
+    assert cache.stem('running') == 'run'
+    assert cache.drain() == [] and cache.new_stems == []
+    cache = StemCache(maxsize=10, track_new=True)
+    assert cache.stem('running') == 'run'
+    assert cache.stem('running') == 'run'
+    assert cache.drain() == [('running', 'run')]
+    assert cache.drain() == []
+
+
+def test_stem_cache_save_load(tmp_path):
+    cache = StemCache()
+    for word in ['kissed', 'clocking', 'stories']:
+        cache.stem(word)
+    path = str(tmp_path / 'stems.dat')
+    cache.save(path)
+    loaded = StemCache()
+    loaded.load(path)
+    assert dict(loaded.items()) == {'kissed': 'kiss', 'clocking': 'clock', 'stories': 'stori'}
+    assert loaded.drain() == []
@@ -0,0 +1,32 @@
+import os
+import pytest
+from create import read_stopwords2, stream_collection, create_invertedindex, make_dir
+
+# Folder of the test collections and of stopwords.dat
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """ Moves the test to an empty folder holding an index/ folder and returns the stopwords
+    """
+    stop = read_stopwords2(os.path.join(FOLDER, 'stopwords.dat'))
+    monkeypatch.chdir(tmp_path)
+    make_dir('index')
+    return stop
+
+
+@pytest.fixture
+def build(workdir):
+    """ Returns a function that indexes a collection into index/name, in the binary format for a .bin name, and
+    returns the stopwords. The collection is read from the working folder if the test wrote it there, from the
+    folder of the test collections otherwise
+    """
+    def build_index(collection='small2.xml', name='myIndex.bin', titles='myTitles.dat', **kwargs):
+        if not os.path.exists(collection):
+            collection = os.path.join(FOLDER, collection)
+        index_format = 'binary' if name.endswith('.bin') else 'json'
+        create_invertedindex(stream_collection(collection, workdir, titles), name, index_format=index_format,
+                             **kwargs)
+        return workdir
+    return build_index
@@ -7,9 +7,18 @@ from typing import Dict, List
 import argparse
 from argparse import ArgumentParser
 import xml.etree.ElementTree as ET
-from xml.etree import cElementTree
 from nltk.stem import PorterStemmer
+from cache import StemCache
+from postings import BinaryIndex, write_binary_index, finalize_terms, write_doc_stats, doc_stats_path, \
+    write_norms, norms_path, write_collection_stats, collection_stats_path
+from segments import reset_segments, index_lock
+from matrix import MATRIX, write_csr_matrix, remove_csr_matrix
 import os
+import collections
+import heapq
+import itertools
+import tempfile
+import multiprocessing
 from nltk.tokenize import sent_tokenize, word_tokenize
 ###################### Make a directory #####################################
 def make_dir(directory):
@@ -32,126 +41,300 @@ def read_stopwords2(stopwords_path):
     for word in content:
         output[word] = None
     return output
-###################### Read Collection #########################################
-def read_collection(collection_path,stopwords_dict,title_index_path):
-    """ This function reads the collection line by line and converts it to a list of tuples, containing page id,
-    title, and a stream of text
+###################### Stream Pages ############################################
+def iter_pages(collection_path,title_index_path,links=None):
+    """ This function streams the collection page by page with iterparse and yields the raw page id, title
+    and text of each page, writing the titles file as it goes. Every <page> element is cleared once it has
+    been processed, so the XML tree of the whole dump is never held in memory
     inputs:
-    dictionary_path - Path of dictionary as a string
+    collection_path - Path of collection xml file as a string
+    title_index_path - Name of the titles file written to the index folder
+    links - optional LinkCollector that records the links of every page in the same pass
     outputs:
-    content - [(page_id, title, [steam of words]), ...]
+    generator - (page_id, title, text), ...
     """
-    ps = PorterStemmer()
-    tree = ET.parse(collection_path)
-    root = tree.getroot()
+    context = ET.iterparse(collection_path, events=('start', 'end'))
+    _, root = next(context)
     ns = re.match('{.*}', root.tag)
     if ns == None:
         ns = ''
     else:
         ns = ns.group()
-    pages = root.findall(ns + 'page')
-
-    output_file = open(os.path.join("index",title_index_path),"w")
-    output=[]
-    for p in pages:
-        page_title = p.find(ns + 'title').text
-        page_id = p.find(ns + 'id').text
-        output_file.write(page_id + ' ' + page_title)
-        output_file.write("\n")
-        for t in p.iter(ns + 'text'):
-            page_text = t.text
-        if page_title == None:
-            page_title = ''
-        if page_text == None:
-            page_text = ''
-
-        full_text = page_title + ' ' + page_text
-        full_text=full_text.lower()
-        text_split = re.split('[^a-z0-9]*',full_text)
-        text_split=list(filter(None,text_split))
-
-        remove_stop = []
-        for idx, val in enumerate(text_split):
-            if val in stopwords_dict:
-                pass
-            else:
-                remove_stop.append(text_split[idx])
-        final_string = [ps.stem(w) for w in remove_stop]
-        output.append((page_id,page_title,final_string))
-    output_file.close()
+
+    with open(os.path.join("index",title_index_path),"w") as output_file:
+        for event, p in context:
+            if event != 'end' or p.tag != ns + 'page':
+                continue
+            page_title = p.find(ns + 'title').text
+            page_id = p.find(ns + 'id').text
+            output_file.write(page_id + ' ' + page_title)
+            output_file.write("\n")
+            page_text = None
+            for t in p.iter(ns + 'text'):
+                page_text = t.text
+            if page_title == None:
+                page_title = ''
+            if page_text == None:
+                page_text = ''
+            if links is not None:
+                links.add(page_id,page_title,page_text)
+            # Release the processed page (and the reference the root keeps to it)
+            p.clear()
+            root.clear()
+            yield (page_id,page_title,page_text)
+###################### Analyze Pages ###########################################
+stem_cache = StemCache()
+
+def analyze_page(page,stopwords_dict):
+    """ This function lowercases, tokenizes, removes stopwords from and stems the title and text of a page
+    inputs:
+    page - (page_id, title, text)
+    stopwords_dict - dictionary of stopwords
+    outputs:
+    output - (page_id, title, [steam of words])
+    """
+    page_id, page_title, page_text = page
+    full_text = page_title + ' ' + page_text
+    full_text=full_text.lower()
+    text_split = re.split('[^a-z0-9]+',full_text)
+    text_split=list(filter(None,text_split))
+
+    remove_stop = []
+    for idx, val in enumerate(text_split):
+        if val in stopwords_dict:
+            pass
+        else:
+            remove_stop.append(text_split[idx])
+    final_string = [stem_cache.stem(w) for w in remove_stop]
+    return (page_id,page_title,final_string)
+
+# Stopwords of a worker process, set once by init_analyzer instead of being pickled with every batch
+worker_stopwords = {}
+
+def init_analyzer(stopwords_dict):
+    global worker_stopwords
+    worker_stopwords = stopwords_dict
+    stem_cache.track_new = True
+    stem_cache.drain()
+
+def analyze_batch(batch):
+    # Send back the stems this worker computed for the first time, so the parent's table stays complete
+    output = [analyze_page(page,worker_stopwords) for page in batch]
+    return output, stem_cache.drain()
+
+def iter_batches(pages,batch_size):
+    batch = []
+    for page in pages:
+        batch.append(page)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def analyze_parallel(pages,stopwords_dict,workers,batch_size=256):
+    """ This function sends batches of raw pages to a pool of worker processes and yields the analyzed pages
+    in their original order. At most two batches per worker are in flight, so the collection is still read
+    lazily
+    inputs:
+    pages - iterable of (page_id, title, text)
+    stopwords_dict - dictionary of stopwords
+    workers - number of worker processes
+    batch_size - number of pages sent to a worker at a time
+    outputs:
+    generator - (page_id, title, [steam of words]), ...
+    """
+    with multiprocessing.Pool(workers,initializer=init_analyzer,initargs=(stopwords_dict,)) as pool:
+        pending = collections.deque()
+        for batch in iter_batches(pages,batch_size):
+            pending.append(pool.apply_async(analyze_batch,(batch,)))
+            if len(pending) >= 2*workers:
+                yield from collect_batch(pending.popleft())
+        while pending:
+            yield from collect_batch(pending.popleft())
+
+def collect_batch(result):
+    output, new_stems = result.get()
+    stem_cache.update(new_stems)
     return output
+###################### Stream Collection #######################################
+def stream_collection(collection_path,stopwords_dict,title_index_path,workers=1,links=None):
+    """ This function streams the collection and yields a tuple containing page id, title, and a stream of
+    text for each page
+    inputs:
+    collection_path - Path of collection xml file as a string
+    stopwords_dict - dictionary of stopwords
+    title_index_path - Name of the titles file written to the index folder
+    workers - number of processes used to tokenize and stem the pages (1 analyzes them in this process)
+    links - optional LinkCollector filled with the link graph while the pages are read
+    outputs:
+    generator - (page_id, title, [steam of words]), ...
+    """
+    pages = iter_pages(collection_path,title_index_path,links)
+    if workers > 1:
+        yield from analyze_parallel(pages,stopwords_dict,workers)
+    else:
+        for page in pages:
+            yield analyze_page(page,stopwords_dict)
+###################### Read Collection #########################################
+def read_collection(collection_path,stopwords_dict,title_index_path):
+    """ This function reads the collection and converts it to a list of tuples, containing page id,
+    title, and a stream of text
+    inputs:
+    collection_path - Path of collection xml file as a string
+    outputs:
+    content - [(page_id, title, [steam of words]), ...]
+    """
+    return list(stream_collection(collection_path,stopwords_dict,title_index_path))
 ###################### Create Inverted Index with tf-idf #####################################
-def create_invertedindex(corpus,inverted_index_path):
+# Rough in-memory cost of the postings of a block, used to decide when a block is flushed to disk
+TERM_BYTES = 120
+POSTING_BYTES = 240
+POSITION_BYTES = 36
+# Most run files open at once while merging; more runs are merged in several passes
+MAX_RUNS = 64
+
+def flush_block(block,run_dir):
+    """ This function writes the postings of a block to a run file, one JSON line per term in sorted term order
+    inputs:
+    block - {word:{page_id:[position,..]}..}
+    run_dir - folder of the temporary run files
+    outputs:
+    path - Path of the run file
+    """
+    fd, path = tempfile.mkstemp(suffix='.run',dir=run_dir)
+    with os.fdopen(fd,'w') as run_file:
+        for word in sorted(block):
+            run_file.write(json.dumps([word,block[word]]))
+            run_file.write('\n')
+    return path
+
+def read_run(path):
+    with open(path,'r') as run_file:
+        for line in run_file:
+            yield json.loads(line)
+
+def merge_group(run_paths):
+    """ This function merges consecutive run files into one run file next to them and removes them
+    inputs:
+    run_paths - list of at most MAX_RUNS run file paths
+    outputs:
+    path - Path of the merged run file
+    """
+    if len(run_paths) == 1:
+        return run_paths[0]
+    fd, path = tempfile.mkstemp(suffix='.run',dir=os.path.dirname(run_paths[0]))
+    with os.fdopen(fd,'w') as run_file:
+        for word, postings in merge_runs(run_paths):
+            run_file.write(json.dumps([word,postings]))
+            run_file.write('\n')
+    for run_path in run_paths:
+        os.remove(run_path)
+    return path
+
+def merge_runs(run_paths):
+    """ This function k-way merges sorted run files and yields the complete postings of every term in sorted
+    term order. Pages never span two runs and runs are written in corpus order, so the postings of a term are
+    concatenated in corpus order as well. With more than MAX_RUNS runs, consecutive groups of MAX_RUNS are first
+    merged into longer runs, so at most MAX_RUNS files are open at once
+    inputs:
+    run_paths - list of run file paths
+    outputs:
+    generator - (word, {page_id:[position,..]}), ...
+    """
+    while len(run_paths) > MAX_RUNS:
+        run_paths = [merge_group(run_paths[i:i+MAX_RUNS]) for i in range(0,len(run_paths),MAX_RUNS)]
+    merged = heapq.merge(*[read_run(path) for path in run_paths],key=lambda entry: entry[0])
+    for word, entries in itertools.groupby(merged,key=lambda entry: entry[0]):
+        postings = {}
+        for entry in entries:
+            postings.update(entry[1])
+        yield word, postings
+
+def write_invertedindex(terms,outfile):
+    """ This function writes the index as JSON, one term per line, without holding the whole index in memory
+    inputs:
+    terms - iterable of (word, {page_id:[[position,..],tf,tf_norm]}, idf, blocks)
+    outfile - open file object
+    """
+    outfile.write('{')
+    sep = '\n'
+    for word, postings, idf, blocks in terms:
+        outfile.write(sep + json.dumps(word) + ': ' + json.dumps([postings,idf]))
+        sep = ',\n'
+    outfile.write('\n}\n')
+
+def create_invertedindex(corpus,inverted_index_path,memory_budget=None,index_format='json'):
     """ This function reads in a list of tuples containing page id, title, and text of the complete corpus and
-    generates an inverted index as a JSON file
-    corpus - [(page_id, title, [steam of words]), ...]
+    generates an inverted index as a JSON or binary file (see postings.py). Only positions are accumulated per
+    token, in blocks; once a block exceeds the memory budget it is flushed to a sorted run file and the runs are
+    k-way merged, so the index can grow past the available RAM. tf, tf_norm, idf and the document norms are then
+    computed in bulk by postings.finalize_terms as the terms are written
+    corpus - iterable of (page_id, title, [steam of words]), e.g. the generator returned by stream_collection
+    memory_budget - approximate size of a block in bytes (None keeps the whole index in memory)
+    index_format - 'json' or 'binary'
     output:
     JSON file - {word:{page_id:[[position,..],tf,tf_norm],idf}..}
+    statistics file - page_id|length|norm per document (see postings.write_doc_stats)
+    collection statistics - N, total tokens and average document length (see postings.write_collection_stats)
     """
-    dict_word = {}
-    total_doc = len(corpus)
-    tf = 0
-    idf = 0
-    tf_norm = 0
-    for page in corpus:
-        for idx,word in enumerate(page[2]):
-            if word in dict_word:
-                if page[0] in dict_word[word][0]:
-                    doc_id_list = dict_word[word][0][page[0]][0]
-                    doc_id_list.append(idx)
+    inverted_index_path = os.path.join("index",inverted_index_path)
+    with tempfile.TemporaryDirectory(prefix='runs',dir=os.path.dirname(inverted_index_path)) as run_dir:
+        run_paths = []
+        block = {}
+        block_bytes = 0
+        total_doc = 0
+        doc_lengths = {}
+        for page in corpus:
+            total_doc += 1
+            doc_lengths[page[0]] = len(page[2])
+            for idx,word in enumerate(page[2]):
+                postings = block.get(word)
+                if postings is None:
+                    # block[word] gets into "{page[0]:[idx]}"
+                    block[word]={page[0]:[idx]}
+                    block_bytes += TERM_BYTES + POSTING_BYTES
+                elif page[0] in postings:
+                    postings[page[0]].append(idx)
                 else:
-                    #dict_word[word] gets into "[{page[0]:[idx]},idf]",
-                    # accessing the 1st element get the dictionary "{page[0]:[[idx],tf]}"
-                    # using "[page[0]]" to check the key in the previous dictionary
-                    dict_word[word][0][page[0]]=[[idx],tf,tf_norm]
-            else:
-                dict_word[word]=[{page[0]:[[idx],tf,tf_norm]},idf]
-            # Update the tf
-            tf = len(dict_word[word][0][page[0]][0])
-            dict_word[word][0][page[0]][1] = tf
-            # Update normalized tf
-            tf_norm = tf/len(page[2])
-            dict_word[word][0][page[0]][2] = tf_norm
-            # Update the idf
-            idf = math.log(float(len(dict_word[word][0]))/total_doc)
-            idf = -idf
-            dict_word[word][1] = idf
-
-    #print(dict_word.keys())
-    with open(os.path.join("index",inverted_index_path), 'w') as outfile:
-       json.dump(dict_word, outfile, indent=4)
+                    postings[page[0]]=[idx]
+                    block_bytes += POSTING_BYTES
+                block_bytes += POSITION_BYTES
+            # Blocks are only cut between pages
+            if memory_budget is not None and block_bytes >= memory_budget:
+                run_paths.append(flush_block(block,run_dir))
+                block = {}
+                block_bytes = 0
+
+        if run_paths:
+            if block:
+                run_paths.append(flush_block(block,run_dir))
+            terms = merge_runs(run_paths)
+        else:
+            terms = ((word,block[word]) for word in sorted(block))
+        sq_norms = {}
+        terms = finalize_terms(terms,doc_lengths,sq_norms)
+        # The index is written next to the old one and swapped in last: a running query may have the old
+        # binary index mapped in memory
+        if index_format == 'binary':
+            with open(inverted_index_path + '.tmp', 'wb') as outfile:
+                write_binary_index(terms,doc_lengths,outfile)
+        else:
+            with open(inverted_index_path + '.tmp', 'w') as outfile:
+                write_invertedindex(terms,outfile)
+        write_doc_stats(doc_stats_path(inverted_index_path),doc_lengths,sq_norms)
+        if index_format == 'binary':
+            write_norms(norms_path(inverted_index_path),doc_lengths,sq_norms)
+        write_collection_stats(collection_stats_path(inverted_index_path),doc_lengths)
+        os.replace(inverted_index_path + '.tmp',inverted_index_path)
 ###########################################################
 ###########################################################
 ###########################################################
-def parse(collection_path: str) -> Dict[int, List[int]]:
-    """Parses the collection file and returns a dictionary mapping
-    documents to the documents that they link to.
-
-    The dictionary keys and values are int document ids.
-
-    Note: We recommend that you don't change this code.
+def resolve_links(doc_ids: Dict[str, int],
+                  outlink_titles: Dict[int, List[str]]) -> Dict[int, List[int]]:
+    """Maps the linked titles of every document to document ids,
+    dropping links to unknown titles and isolated documents.
     """
-    root = cElementTree.parse(collection_path).getroot()
-    match = re.match(r'{.*}', root.tag)
-    namespace = match.group() if match else ''
-
-    doc_ids = {}
-    outlink_titles = {}
-    for page in root.iter(namespace + 'page'):
-        id_ = int(page.find(namespace + 'id').text)
-        title = page.find(namespace + 'title').text
-        assert id_ is not None and title is not None
-        # Note this doesn't work on the small index, we aren't using
-        # the small index anymore in the course
-        text = page.find(namespace + 'revision').find(namespace + 'text').text
-        if text is None:
-            links = []
-        else:
-            links = extract_links(text)
-
-        doc_ids[title] = id_
-        outlink_titles[id_] = links
-
     outlink_ids = {}
     for id_, titles in outlink_titles.items():
         outlink_ids[id_] = [doc_ids[title]
@@ -164,6 +347,24 @@ def parse(collection_path: str) -> Dict[int, List[int]]:
     return outlink_ids
 
 
+class LinkCollector:
+    """Collects the links of the pages seen while the collection is
+    streamed, so the PageRank graph is built without parsing the XML
+    a second time.
+    """
+    def __init__(self):
+        self.doc_ids = {}
+        self.outlink_titles = {}
+
+    def add(self, page_id: str, title: str, text: str):
+        id_ = int(page_id)
+        self.doc_ids[title] = id_
+        self.outlink_titles[id_] = extract_links(text) if text else []
+
+    def outlinks(self) -> Dict[int, List[int]]:
+        return resolve_links(self.doc_ids, self.outlink_titles)
+
+
 def extract_links(text: str) -> List[str]:
     """Returns the links in the body text. The links are
     title strings.
@@ -246,24 +447,12 @@ def rank(outlinks: Dict[int, List[int]],
     #print('sort dict', x[0:5])
     return rank_dict
 
-def main_func(collection_path: str):
-    """Saves the outlinks dictionary as a JSON file then computes
-    and saves the PageRank scores.
-
-    Note: We recommend that you don't change this code.
+def write_scores(outlinks: Dict[int, List[int]]):
+    """Computes the PageRank scores of the link graph and saves them
+    to the index folder, one id|score line per document.
     """
-    try:
-        with open('links.json', 'r') as fp:
-            with_str_keys = json.load(fp)
-            outlinks = {int(key): val for key, val in with_str_keys.items()}
-        print('Using existing links file')
-    except FileNotFoundError:
-        print('Creating new links file')
-        outlinks = parse(collection_path)
-        with open('links.json', 'w') as fp:
-            json.dump(outlinks, fp)
-
-    scores = rank(outlinks)
+    # A collection without any links has nothing to rank
+    scores = rank(outlinks) if outlinks else {}
 
     #with open('scores.dat', 'w') as fp:
     with open(os.path.join("index", 'score.dat'), 'w') as fp:
@@ -282,6 +471,13 @@ def main():
         parser.add_argument('my_stopwords',nargs='?', help='Path to stopwords dat file')
         parser.add_argument('my_collection',nargs='?', help='Path to collection xml file')
         parser.add_argument('index_folder',nargs='?', help='Path to index dat file')
+        parser.add_argument('--workers', type=int, default=1, help='Number of processes used to tokenize and stem pages')
+        parser.add_argument('--memory-budget', type=float, default=None, dest='memory_budget',
+                            help='Approximate memory (MB) of the postings kept in RAM before a run is flushed to disk')
+        parser.add_argument('--format', choices=['binary', 'json'], default='binary', dest='index_format',
+                            help='Format of the inverted index: compressed binary (myIndex.bin) or JSON (myIndex.dat)')
+        parser.add_argument('--csr', action='store_true',
+                            help='Also write the tf-idf document-term matrix as CSR NumPy arrays (myMatrix.*.npy)')
         # parser.add_argument('my_titles', help='Path to titles dat file')
         args = parser.parse_args()
         #
@@ -292,15 +488,39 @@ def main():
         # print("~ Titles path: {}".format(args.my_titles))
         #print(len(vars(args)))
 
-        index = 'myIndex.dat'
+        index = 'myIndex.bin' if args.index_format == 'binary' else 'myIndex.dat'
         titles = 'myTitles.dat'
+        stems = 'myStems.dat'
 
         if not os.path.exists('index/'):
             make_dir(args.index_folder)
         stopwords=read_stopwords2(args.my_stopwords)
-        t1=read_collection(args.my_collection,stopwords,titles)
-        create_invertedindex(t1,index)
-        main_func(args.my_collection)
+        # Text and links are extracted in the same pass over the collection
+        links = LinkCollector()
+        t1=stream_collection(args.my_collection,stopwords,titles,args.workers,links)
+        memory_budget = None if args.memory_budget is None else int(args.memory_budget * 2**20)
+        # The rebuild holds the index lock, so an update or a merge cannot add a segment to the manifest it resets
+        with index_lock("index"):
+            # A full rebuild replaces the segments added by update.py
+            reset_segments("index")
+            create_invertedindex(t1,index,memory_budget,args.index_format)
+            # open_index prefers myIndex.bin, so the index of the other format must not outlive the rebuild
+            other_index = os.path.join("index", 'myIndex.dat' if args.index_format == 'binary' else 'myIndex.bin')
+            if os.path.exists(other_index):
+                os.remove(other_index)
+        matrix = os.path.join("index", MATRIX)
+        remove_csr_matrix(matrix)
+        if args.csr:
+            if args.index_format == 'binary':
+                write_csr_matrix(BinaryIndex(os.path.join("index", index), cache_size=0), matrix)
+            else:
+                with open(os.path.join("index", index), 'r') as f:
+                    write_csr_matrix(json.load(f), matrix)
+        stem_cache.save(os.path.join("index",stems))
+        outlinks = links.outlinks()
+        with open('links.json', 'w') as fp:
+            json.dump(outlinks, fp)
+        write_scores(outlinks)
 
         # stopwords=read_stopwords2('stopwords.dat')
         # collection=read_collection('pixar_pages_current .xml',stopwords,'myTitlesPixar2.dat')
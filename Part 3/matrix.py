@@ -0,0 +1,109 @@
+import math
+import os
+import numpy as np
+from postings import postings_arrays, term_idf
+
+# The document-term matrix of an index is stored as NumPy arrays next to it, one file per array:
+#   <name>.indptr.npy   - int64, row i holds the entries indptr[i]:indptr[i+1]
+#   <name>.indices.npy  - int32 term id of every entry, sorted within a row
+#   <name>.data.npy     - float64 tf-idf weight of every entry
+#   <name>.docs.npy     - int64 page id of every row (sorted)
+#   <name>.norms.npy    - float64 norm of every row
+#   <name>.idf.npy      - float64 idf of every term
+#   <name>.terms        - the term of every term id, one per line in sorted order
+MATRIX = 'myMatrix'
+ARRAYS = ('indptr', 'indices', 'data', 'docs', 'norms', 'idf')
+
+
+def matrix_path(prefix, part):
+    return prefix + '.' + part + ('.npy' if part in ARRAYS else '')
+
+
+def write_csr_matrix(inverted_index, prefix):
+    """ This function writes the tf-idf weights of an index as a compressed sparse row document-term matrix
+    inputs:
+    inverted_index - {word:[{page_id:[[position,..],tf,tf_norm]},idf]..} or an index object
+    prefix - path of the matrix files without their extension, e.g. index/myMatrix
+    """
+    words = sorted(inverted_index.keys())
+    rows = []
+    cols = []
+    data = []
+    idfs = np.zeros(len(words))
+    for term_id, word in enumerate(words):
+        doc_ids, tfs = postings_arrays(inverted_index, word)
+        idfs[term_id] = term_idf(inverted_index, word)
+        rows.append(doc_ids)
+        cols.append(np.full(len(doc_ids), term_id, dtype=np.int32))
+        data.append(tfs * idfs[term_id])
+    rows = np.concatenate(rows) if words else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if words else np.zeros(0, dtype=np.int32)
+    data = np.concatenate(data) if words else np.zeros(0)
+
+    doc_ids, rows = np.unique(rows, return_inverse=True)
+    # Entries are grouped by row; the stable sort keeps the term ids of a row sorted
+    order = np.argsort(rows, kind='stable')
+    counts = np.bincount(rows, minlength=len(doc_ids))
+    indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=len(doc_ids)))
+    data = data[order]
+
+    np.save(matrix_path(prefix, 'indptr'), indptr)
+    np.save(matrix_path(prefix, 'indices'), cols[order])
+    np.save(matrix_path(prefix, 'data'), data)
+    np.save(matrix_path(prefix, 'docs'), doc_ids.astype(np.int64))
+    np.save(matrix_path(prefix, 'norms'), norms)
+    np.save(matrix_path(prefix, 'idf'), idfs)
+    with open(matrix_path(prefix, 'terms'), 'w') as f:
+        for word in words:
+            f.write(word + '\n')
+
+
+def remove_csr_matrix(prefix):
+    for part in ARRAYS + ('terms',):
+        if os.path.exists(matrix_path(prefix, part)):
+            os.remove(matrix_path(prefix, part))
+
+
+class CSRMatrix:
+    """ Document-term tf-idf matrix written by write_csr_matrix. The arrays are memory-mapped, so opening the
+    matrix reads nothing but the term map
+    """
+    def __init__(self, prefix, mmap_mode='r'):
+        for part in ARRAYS:
+            setattr(self, part, np.load(matrix_path(prefix, part), mmap_mode=mmap_mode))
+        with open(matrix_path(prefix, 'terms'), 'r') as f:
+            self.term_ids = {line.rstrip('\n'): term_id for term_id, line in enumerate(f)}
+        # First entry of every non-empty row, for np.add.reduceat
+        self.starts = np.asarray(self.indptr[:-1])[np.diff(self.indptr) > 0]
+        self.filled = np.diff(self.indptr) > 0
+
+    def query_vector(self, q_word):
+        """ This function weights the query terms like get_cosine_score: the idf of a term is added once per
+        occurrence in the query
+        outputs:
+        output - (dense float64 vector over the term ids, norm of the vector)
+        """
+        vector = np.zeros(len(self.idf))
+        for word in q_word:
+            term_id = self.term_ids.get(word)
+            if term_id is not None:
+                vector[term_id] += self.idf[term_id]
+        return vector, math.sqrt(float(np.dot(vector, vector)))
+
+    def dot(self, vector):
+        """ Sparse matrix-vector product: the score of every row against a vector of term weights
+        """
+        output = np.zeros(len(self.docs))
+        if len(self.starts):
+            output[self.filled] = np.add.reduceat(self.data * vector[self.indices], self.starts)
+        return output
+
+    def cosine(self, q_word):
+        """ This function returns the cosine similarity of every document with the query
+        outputs:
+        output - float64 array aligned with self.docs
+        """
+        vector, query_weight = self.query_vector(q_word)
+        denominator = query_weight * self.norms
+        return np.divide(self.dot(vector), denominator, out=np.zeros(len(self.docs)), where=denominator > 0)
@@ -0,0 +1,32 @@
+import os
+import numpy as np
+import pytest
+from matrix import CSRMatrix, write_csr_matrix
+from postings import BinaryIndex, read_binary_index, read_doc_stats
+from query import get_cosine_score, get_csr_score
+
+
+def test_csr_matrix(build):
+    build(titles='titles.dat')
+    index = BinaryIndex(os.path.join('index', 'myIndex.bin'))
+    write_csr_matrix(index, os.path.join('index', 'myMatrix'))
+    matrix = CSRMatrix(os.path.join('index', 'myMatrix'))
+    assert isinstance(matrix.data, np.memmap)
+
+    content = read_binary_index(os.path.join('index', 'myIndex.bin'))
+    assert matrix.docs.tolist() == index.doc_ids.tolist()
+    assert sorted(matrix.term_ids, key=matrix.term_ids.get) == sorted(content)
+    for row, page_id in enumerate(matrix.docs.tolist()):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        words = [word for word in content if str(page_id) in content[word][0]]
+        assert sorted(matrix.indices[start:end].tolist()) == matrix.indices[start:end].tolist()
+        assert sorted(matrix.term_ids[word] for word in words) == matrix.indices[start:end].tolist()
+
+    doc_stats = read_doc_stats(os.path.join('index', 'myIndex.docstats'))
+    assert matrix.norms == pytest.approx([doc_stats[str(page_id)][1] for page_id in matrix.docs.tolist()])
+    match_ids = matrix.docs.tolist() + [99]
+    for q_word in (['2001', 'space'], ['kiss', 'film', 'kiss', 'zzz'], ['zzz']):
+        expected = get_cosine_score(content, doc_stats, q_word, match_ids)
+        ranked = get_csr_score(matrix, q_word, match_ids)
+        assert dict(ranked) == pytest.approx(dict(expected))
+        assert [score for page_id, score in ranked] == pytest.approx([score for page_id, score in expected])
@@ -0,0 +1,718 @@
+import json
+import math
+import mmap
+import os
+import struct
+import numpy as np
+from cache import LRUCache
+
+# Binary index layout (all integers little endian):
+#   header      - MAGIC, VERSION
+#   postings    - one record per term: varint doc id gaps, varint tfs, varint position gaps
+#   doc table   - int64 doc ids (sorted), uint32 doc lengths
+#   dictionary  - newline separated terms, uint64 record offsets (plus an end offset), uint32 df, float64 idf,
+#                 float32 max score (the highest BM25 contribution of the term to any document, rounded up)
+#   blocks      - for the terms with more than BLOCK_SIZE postings, for every block of BLOCK_SIZE postings:
+#                 int64 last doc id, then float32 max score (rounded up), then uint32 byte offsets of its first
+#                 doc id gap and of its first tf in the record of the term
+#   footer      - doc table offset, dictionary offset, number of docs, number of terms, MAGIC
+MAGIC = b'SEIX'
+VERSION = 4
+HEADER = struct.Struct('<4sI')
+FOOTER = struct.Struct('<QQQQ4s')
+
+# BM25 parameters the max scores of the index are computed with
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Number of postings summarized by a block max score
+BLOCK_SIZE = 128
+
+
+def varint_lengths(values):
+    # Number of bytes of the varint of every value
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nbytes += rest > 0
+        rest >>= np.uint64(7)
+    return nbytes
+
+
+def encode_varints(values):
+    """ This function encodes non-negative integers as LEB128 varints (7 bits per byte, high bit set on every
+    byte but the last of a value)
+    inputs:
+    values - iterable or array of non-negative integers
+    outputs:
+    output - bytes
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b''
+    nbytes = varint_lengths(values)
+    starts = np.cumsum(nbytes) - nbytes
+    output = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        group = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (nbytes[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        output[starts[mask] + k] = group | more
+    return output.tobytes()
+
+
+def decode_varints(buf, count=None):
+    """ This function decodes a buffer of LEB128 varints
+    inputs:
+    buf - bytes-like object holding whole varints
+    count - number of varints to decode from the start of buf (all of them if None)
+    outputs:
+    output - uint64 numpy array
+    """
+    buf = np.frombuffer(buf, dtype=np.uint8)
+    if len(buf) == 0 or count == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(buf < 0x80)
+    if count is not None:
+        ends = ends[:count]
+        buf = buf[:ends[-1] + 1]
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = ((np.arange(len(buf)) - starts[group]) * 7).astype(np.uint64)
+    values = (buf & 0x7f).astype(np.uint64) << shifts
+    return np.add.reduceat(values, starts)
+
+
+def encode_postings(postings, block_offsets=None):
+    """ This function encodes the postings of a term. Doc ids are sorted and delta encoded, positions are gap
+    encoded within each document
+    inputs:
+    postings - {page_id:[[position,..],tf,...]}
+    block_offsets - optional list, extended with the byte offsets in the record of the first doc id gap and of
+                    the first tf of every block of BLOCK_SIZE postings
+    outputs:
+    output - bytes
+    """
+    doc_ids = sorted(postings, key=int)
+    ids = np.array([int(page_id) for page_id in doc_ids], dtype=np.int64)
+    gaps = np.diff(ids, prepend=0)
+    tfs = [len(postings[page_id][0]) for page_id in doc_ids]
+    positions = []
+    for page_id in doc_ids:
+        previous = 0
+        for position in sorted(postings[page_id][0]):
+            positions.append(position - previous)
+            previous = position
+    gap_bytes = encode_varints(gaps)
+    if block_offsets is not None:
+        firsts = np.arange(0, len(doc_ids), BLOCK_SIZE)
+        gap_offsets = np.concatenate(([0], np.cumsum(varint_lengths(gaps))))[firsts]
+        tf_offsets = len(gap_bytes) + np.concatenate(([0], np.cumsum(varint_lengths(tfs))))[firsts]
+        block_offsets.extend(zip(gap_offsets.tolist(), tf_offsets.tolist()))
+    return gap_bytes + encode_varints(tfs) + encode_varints(positions)
+
+
+def decode_postings(buf, df):
+    """ This function decodes a postings record
+    inputs:
+    buf - bytes of the record
+    df - number of documents of the term
+    outputs:
+    output - (doc ids as int64 array, tfs as int64 array, list of position arrays per document)
+    """
+    values = decode_varints(buf).astype(np.int64)
+    doc_ids = np.cumsum(values[:df])
+    tfs = values[df:2 * df]
+    gaps = values[2 * df:]
+    bounds = np.cumsum(tfs)[:-1]
+    positions = [np.cumsum(doc_gaps) for doc_gaps in np.split(gaps, bounds)]
+    return doc_ids, tfs, positions
+
+
+def doc_stats_path(index_path):
+    """ Per-document statistics are stored next to an index file: myIndex.bin -> myIndex.docstats
+    """
+    return os.path.splitext(index_path)[0] + '.docstats'
+
+
+def norms_path(index_path):
+    """ The document norms of a binary index are stored next to it: myIndex.bin -> myIndex.norms.npy
+    """
+    return os.path.splitext(index_path)[0] + '.norms.npy'
+
+
+def collection_stats_path(index_path):
+    """ Collection statistics are stored next to an index file: myIndex.bin -> myIndex.stats.json
+    """
+    return os.path.splitext(index_path)[0] + '.stats.json'
+
+
+def iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def finalize_terms(terms, doc_lengths, sq_norms, chunk_size=4096):
+    """ This function is the finalization stage of index construction. The raw postings are processed in chunks
+    of terms: df, idf, tf and tf_norm are computed with NumPy once per chunk, and the squared tf-idf weight of
+    every posting is added to the squared norm of its document. The postings of a term are cut into blocks of
+    BLOCK_SIZE documents in doc id order, and the max score of a block is the highest BM25 contribution (with
+    BM25_K1 and BM25_B) of the term to one of its documents
+    inputs:
+    terms - iterable of (word, {page_id:[position,..]}) in sorted term order
+    doc_lengths - {page_id: number of tokens} of every document of the corpus
+    sq_norms - {page_id: squared norm}, filled once the terms are exhausted
+    chunk_size - number of terms finalized at a time
+    outputs:
+    generator - (word, {page_id:[[position,..],tf,tf_norm]}, idf, (block last doc ids, block max scores)), ...
+    """
+    doc_ids = list(doc_lengths)
+    ordinals = {page_id: i for i, page_id in enumerate(doc_ids)}
+    int_ids = np.array([int(page_id) for page_id in doc_ids], dtype=np.int64)
+    lengths = np.array([doc_lengths[page_id] for page_id in doc_ids], dtype=np.float64)
+    total_doc = len(doc_ids)
+    sq = np.zeros(total_doc)
+    if total_doc:
+        length_norms = 1 - BM25_B + BM25_B * lengths / lengths.mean()
+    for chunk in iter_chunks(terms, chunk_size):
+        dfs = np.array([len(postings) for word, postings in chunk], dtype=np.int64)
+        idfs = -np.log(dfs / total_doc)
+        page_ids = [page_id for word, postings in chunk for page_id in postings]
+        docs = np.array([ordinals[page_id] for page_id in page_ids], dtype=np.int64)
+        tfs = np.array([len(positions) for word, postings in chunk for positions in postings.values()],
+                       dtype=np.int64)
+        tf_norms = tfs / lengths[docs]
+        np.add.at(sq, docs, (tfs * np.repeat(idfs, dfs)) ** 2)
+        bm25_idfs = np.log(1 + (total_doc - dfs + 0.5) / (dfs + 0.5))
+        bm25 = np.repeat(bm25_idfs, dfs) * tfs * (BM25_K1 + 1) / (tfs + BM25_K1 * length_norms[docs])
+
+        # Blocks follow the doc id order of the encoded postings
+        order = np.lexsort((int_ids[docs], np.repeat(np.arange(len(chunk)), dfs)))
+        rank = np.arange(len(order)) - np.repeat(np.cumsum(dfs) - dfs, dfs)
+        firsts = np.flatnonzero(rank % BLOCK_SIZE == 0)
+        block_max = np.maximum.reduceat(bm25[order], firsts)
+        block_last = int_ids[docs[order]][np.append(firsts[1:], len(order)) - 1]
+        block_bounds = np.cumsum(-(-dfs // BLOCK_SIZE))[:-1]
+        blocks = zip(np.split(block_last, block_bounds), np.split(block_max, block_bounds))
+
+        tfs = tfs.tolist()
+        tf_norms = tf_norms.tolist()
+        k = 0
+        for (word, postings), idf, term_blocks in zip(chunk, idfs.tolist(), blocks):
+            output = {}
+            for page_id, positions in postings.items():
+                output[page_id] = [positions, tfs[k], tf_norms[k]]
+                k += 1
+            yield word, output, idf, term_blocks
+    for page_id, value in zip(doc_ids, sq.tolist()):
+        sq_norms[page_id] = value
+
+
+def write_collection_stats(path, doc_lengths):
+    """ This function writes the collection statistics of an index: number of documents, total number of tokens
+    and average document length
+    """
+    total_tokens = sum(doc_lengths.values())
+    stats = {'N': len(doc_lengths),
+             'total_tokens': total_tokens,
+             'avg_doc_length': total_tokens / len(doc_lengths) if doc_lengths else 0.0}
+    with open(path + '.tmp', 'w') as f:
+        json.dump(stats, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_collection_stats(path):
+    """ This function reads collection statistics
+    outputs:
+    output - {"N": int, "total_tokens": int, "avg_doc_length": float}
+    """
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_doc_stats(path, doc_lengths, sq_norms):
+    """ This function writes the statistics file of an index, one page_id|length|norm line per document, where
+    length is the number of tokens and norm the length of the tf-idf vector of the document
+    """
+    with open(path + '.tmp', 'w') as f:
+        for page_id in sorted(doc_lengths, key=int):
+            f.write('{}|{}|{}\n'.format(page_id, doc_lengths[page_id], math.sqrt(sq_norms.get(page_id, 0.0))))
+    os.replace(path + '.tmp', path)
+
+
+def write_norms(path, doc_lengths, sq_norms):
+    """ This function writes the norm of the tf-idf vector of every document as a float64 .npy array aligned with
+    the doc table of the binary index (sorted int page ids), so it can be memory-mapped
+    """
+    norms = np.sqrt(np.array([sq_norms.get(page_id, 0.0) for page_id in sorted(doc_lengths, key=int)],
+                             dtype=np.float64))
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, norms)
+    os.replace(path + '.tmp', path)
+
+
+def read_doc_stats(path):
+    """ This function reads a statistics file
+    outputs:
+    output - {page_id: (length, norm)}
+    """
+    output = {}
+    with open(path, 'r') as f:
+        for line in f:
+            page_id, length, norm = line.rstrip().split('|')
+            output[page_id] = (int(length), float(norm))
+    return output
+
+
+def pad(outfile, offset):
+    # Align the numpy sections on 8 bytes
+    padding = -offset % 8
+    outfile.write(b'\0' * padding)
+    return offset + padding
+
+
+def write_binary_index(terms, doc_lengths, outfile):
+    """ This function writes the binary index term by term
+    inputs:
+    terms - iterable of (word, {page_id:[[position,..],tf,tf_norm]}, idf, (block last doc ids, block max scores))
+            in sorted term order
+    doc_lengths - {page_id: number of tokens}
+    outfile - file object opened in binary mode
+    """
+    offset = outfile.write(HEADER.pack(MAGIC, VERSION))
+    words = []
+    offsets = []
+    dfs = []
+    idfs = []
+    max_scores = []
+    block_last = []
+    block_max = []
+    block_offsets = []
+    for word, postings, idf, (term_block_last, term_block_max) in terms:
+        term_block_offsets = []
+        record = encode_postings(postings, term_block_offsets)
+        words.append(word)
+        offsets.append(offset)
+        dfs.append(len(postings))
+        idfs.append(idf)
+        max_scores.append(max(term_block_max))
+        # A single block is summarized by the max score of the term
+        if len(term_block_last) > 1:
+            block_last.append(np.asarray(term_block_last, dtype='<i8'))
+            block_max.append(np.asarray(term_block_max, dtype=np.float64))
+            block_offsets.append(np.asarray(term_block_offsets, dtype=np.int64))
+        offset += outfile.write(record)
+    offsets.append(offset)
+
+    offset = pad(outfile, offset)
+    doc_offset = offset
+    doc_ids = sorted(doc_lengths, key=int)
+    offset += outfile.write(np.array([int(page_id) for page_id in doc_ids], dtype='<i8').tobytes())
+    offset += outfile.write(np.array([doc_lengths[page_id] for page_id in doc_ids], dtype='<u4').tobytes())
+
+    offset = pad(outfile, offset)
+    dict_offset = offset
+    blob = '\n'.join(words).encode('utf-8')
+    offset += outfile.write(struct.pack('<Q', len(blob)))
+    offset += outfile.write(blob)
+    offset = pad(outfile, offset)
+    offset += outfile.write(np.array(offsets, dtype='<u8').tobytes())
+    offset += outfile.write(np.array(dfs, dtype='<u4').tobytes())
+    offset = pad(outfile, offset)
+    offset += outfile.write(np.array(idfs, dtype='<f8').tobytes())
+    # Rounded up, so the stored max scores stay upper bounds
+    offset += outfile.write(np.nextafter(np.array(max_scores, dtype='<f4'), np.float32(np.inf)).tobytes())
+    offset = pad(outfile, offset)
+    if block_last:
+        offset += outfile.write(np.concatenate(block_last).astype('<i8').tobytes())
+        block_max = np.concatenate(block_max).astype('<f4')
+        offset += outfile.write(np.nextafter(block_max, np.float32(np.inf)).tobytes())
+        offset += outfile.write(np.concatenate(block_offsets).astype('<u4').tobytes())
+    outfile.write(FOOTER.pack(doc_offset, dict_offset, len(doc_ids), len(words), MAGIC))
+
+
+def read_sections(buf):
+    """ This function reads the doc table and the locations of the term dictionary of a binary index. The
+    returned arrays are views on buf, nothing is copied
+    inputs:
+    buf - bytes-like object holding the whole index file (e.g. an mmap)
+    outputs:
+    output - (doc ids, doc lengths, term starts, term ends, record offsets, dfs, idfs, max scores, index of the
+              first block of every term (plus an end index), block last doc ids, block max scores, block byte
+              offsets (one row of doc id gap and tf offsets per block))
+    """
+    magic, version = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a binary index (version %d expected)' % VERSION)
+    doc_offset, dict_offset, n_docs, n_terms, _ = FOOTER.unpack_from(buf, len(buf) - FOOTER.size)
+    doc_ids = np.frombuffer(buf, dtype='<i8', count=n_docs, offset=doc_offset)
+    doc_lengths = np.frombuffer(buf, dtype='<u4', count=n_docs, offset=doc_offset + 8 * n_docs)
+
+    blob_length, = struct.unpack_from('<Q', buf, dict_offset)
+    start = dict_offset + 8
+    # Terms are newline separated, so their boundaries are found with one vectorized scan
+    newlines = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8, count=blob_length, offset=start) == 10)
+    term_starts = start + np.concatenate(([0], newlines + 1)) if n_terms else np.zeros(0, dtype=np.int64)
+    term_ends = start + np.concatenate((newlines, [blob_length])) if n_terms else np.zeros(0, dtype=np.int64)
+    start += blob_length
+    start += -start % 8
+    offsets = np.frombuffer(buf, dtype='<u8', count=n_terms + 1, offset=start)
+    start += 8 * (n_terms + 1)
+    dfs = np.frombuffer(buf, dtype='<u4', count=n_terms, offset=start)
+    start += 4 * n_terms
+    start += -start % 8
+    idfs = np.frombuffer(buf, dtype='<f8', count=n_terms, offset=start)
+    start += 8 * n_terms
+    max_scores = np.frombuffer(buf, dtype='<f4', count=n_terms, offset=start)
+    start += 4 * n_terms
+    start += -start % 8
+    n_blocks = -(-dfs.astype(np.int64) // BLOCK_SIZE)
+    n_blocks[n_blocks == 1] = 0
+    block_starts = np.concatenate(([0], np.cumsum(n_blocks)))
+    n_blocks = int(block_starts[-1])
+    block_last = np.frombuffer(buf, dtype='<i8', count=n_blocks, offset=start)
+    block_max = np.frombuffer(buf, dtype='<f4', count=n_blocks, offset=start + 8 * n_blocks)
+    block_offsets = np.frombuffer(buf, dtype='<u4', count=2 * n_blocks, offset=start + 12 * n_blocks).reshape(-1, 2)
+    return doc_ids, doc_lengths, term_starts, term_ends, offsets, dfs, idfs, max_scores, block_starts, block_last, \
+        block_max, block_offsets
+
+
+class BinaryIndex:
+    """ Lazy, memory-mapped reader of a binary index. Only the doc table and the term dictionary (as views on
+    the mapped file) are resident; the postings of a term are decoded the first time they are asked for and
+    kept in a small LRU cache. It behaves like the JSON index: index[word] -> [{page_id:[[position,..],tf,
+    tf_norm]},idf]
+    """
+    def __init__(self, path, cache_size=256):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        sections = read_sections(self.buf)
+        self.doc_ids, self.doc_lengths, self.term_starts, self.term_ends, self.offsets, self.dfs, self.idfs, \
+            self.max_scores, self.block_starts, self.block_last, self.block_max, self.block_offsets = sections
+        self.cache = LRUCache(cache_size)
+        # Bitmap of the documents, built by the first NOT query
+        self.live_bitmap = None
+
+    def __len__(self):
+        return len(self.dfs)
+
+    def term(self, i):
+        return self.buf[self.term_starts[i]:self.term_ends[i]]
+
+    def lookup(self, word):
+        """ Returns the ordinal of word in the (sorted) term dictionary, or -1
+        """
+        key = word.encode('utf-8')
+        lo = 0
+        hi = len(self.dfs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.dfs) and self.term(lo) == key:
+            return lo
+        return -1
+
+    def __contains__(self, word):
+        return self.lookup(word) >= 0
+
+    def __iter__(self):
+        for i in range(len(self.dfs)):
+            yield self.term(i).decode('utf-8')
+
+    def keys(self):
+        return iter(self)
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+    def live_doc_ids(self):
+        # Sorted int ids of the documents of the index
+        return self.doc_ids
+
+    def decode(self, i):
+        return decode_postings(self.buf[self.offsets[i]:self.offsets[i + 1]], int(self.dfs[i]))
+
+    def df(self, word):
+        i = self.lookup(word)
+        return int(self.dfs[i]) if i >= 0 else 0
+
+    def idf(self, word):
+        i = self.lookup(word)
+        if i < 0:
+            raise KeyError(word)
+        return float(self.idfs[i])
+
+    def max_score(self, word):
+        """ Returns the highest BM25 contribution of word to a document (with BM25_K1 and BM25_B), or 0.0
+        """
+        i = self.lookup(word)
+        return float(self.max_scores[i]) if i >= 0 else 0.0
+
+    def postings_arrays(self, word):
+        """ Returns the sorted doc ids and the tfs of the postings of word as int64 arrays, without building
+        the postings dictionary
+        """
+        i = self.lookup(word)
+        if i < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        df = int(self.dfs[i])
+        # The positions are stored after the doc id gaps and the tfs, they are not decoded
+        values = decode_varints(self.buf[self.offsets[i]:self.offsets[i + 1]], 2 * df).astype(np.int64)
+        return np.cumsum(values[:df]), values[df:]
+
+    def iter_postings(self, chunk_size=4096):
+        """ Yields the postings of all the terms, chunk_size terms at a time: the records of a chunk are decoded
+        together and their positions are skipped
+        outputs:
+        output - (term ordinals, doc ids, tfs) int64 arrays, one entry per posting
+        """
+        for lo in range(0, len(self.dfs), chunk_size):
+            hi = min(lo + chunk_size, len(self.dfs))
+            start = int(self.offsets[lo])
+            buf = np.frombuffer(self.buf[start:int(self.offsets[hi])], dtype=np.uint8)
+            values = decode_varints(buf).astype(np.int64)
+            # A record starts after the varints that end before its first byte
+            ends = np.concatenate(([0], np.cumsum(buf < 0x80)))
+            firsts = ends[self.offsets[lo:hi].astype(np.int64) - start]
+            dfs = self.dfs[lo:hi].astype(np.int64)
+            term_starts = np.repeat(np.cumsum(dfs) - dfs, dfs)
+            gaps = np.repeat(firsts, dfs) + np.arange(int(dfs.sum())) - term_starts
+            doc_ids = np.cumsum(values[gaps])
+            doc_ids -= np.concatenate(([0], doc_ids))[term_starts]
+            yield np.repeat(np.arange(lo, hi), dfs), doc_ids, values[gaps + np.repeat(dfs, dfs)]
+
+    def block_postings(self, word):
+        """ Returns the postings of word as BlockPostings, which decodes them block by block, or None
+        """
+        i = self.lookup(word)
+        if i < 0:
+            return None
+        start, end = int(self.block_starts[i]), int(self.block_starts[i + 1])
+        return BlockPostings(self.buf, int(self.offsets[i]), int(self.offsets[i + 1]), int(self.dfs[i]),
+                             self.block_last[start:end], self.block_offsets[start:end])
+
+    def contains(self, word, doc_ids):
+        """ Returns a bool array, True for the doc ids (sorted int64 array) that have a posting of word. Only the
+        blocks of postings the ids fall into are decoded
+        """
+        postings = self.block_postings(word)
+        if postings is None:
+            return np.zeros(len(doc_ids), dtype=bool)
+        return postings.contains(doc_ids)
+
+    def blocks(self, word):
+        """ Returns the last doc id and the max BM25 score (with BM25_K1 and BM25_B) of every block of
+        BLOCK_SIZE postings of word. The last doc id of the last block is the largest int64
+        """
+        i = self.lookup(word)
+        if i < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        start, end = int(self.block_starts[i]), int(self.block_starts[i + 1])
+        if start == end:
+            return np.array([np.iinfo(np.int64).max]), self.max_scores[i:i + 1]
+        block_last = self.block_last[start:end].copy()
+        block_last[-1] = np.iinfo(np.int64).max
+        return block_last, self.block_max[start:end]
+
+    def __getitem__(self, word):
+        entry = self.cache.get(word)
+        if entry is None:
+            i = self.lookup(word)
+            if i < 0:
+                raise KeyError(word)
+            ids, tfs, positions = self.decode(i)
+            tf_norms = tfs / self.doc_lengths[np.searchsorted(self.doc_ids, ids)]
+            postings = {}
+            for page_id, tf, tf_norm, doc_positions in zip(ids.tolist(), tfs.tolist(), tf_norms.tolist(), positions):
+                postings[str(page_id)] = [doc_positions.tolist(), tf, tf_norm]
+            entry = [postings, float(self.idfs[i])]
+            self.cache.put(word, entry)
+        return entry
+
+
+class BlockPostings:
+    """ Doc ids and tfs of the postings of one term of a binary index, decoded one block of BLOCK_SIZE postings
+    at a time. The block table gives the last doc id of every block and where its doc id gaps and tfs start in
+    the record, so a block is read without decoding the ones before it. A term with a single block has no
+    block table and is decoded at once
+    """
+    def __init__(self, buf, start, end, df, block_last, block_offsets):
+        self.buf = buf
+        self.start = start
+        self.end = end
+        self.df = df
+        self.block_offsets = block_offsets
+        self.single = None
+        if len(block_last) == 0:
+            values = self.values(0, 2 * df)
+            self.single = (np.cumsum(values[:df]), values[df:])
+            block_last = self.single[0][-1:]
+        self.last = np.asarray(block_last, dtype=np.int64)
+        self.block_last = self.last.tolist()
+
+    def __len__(self):
+        return self.df
+
+    def values(self, offset, count):
+        # count varints from a byte offset of the record; a varint takes at most 10 bytes
+        end = min(self.start + offset + 10 * count, self.end)
+        return decode_varints(self.buf[self.start + offset:end], count).astype(np.int64)
+
+    def decode_ids(self, j, end):
+        """ Returns the doc ids of the blocks [j, end) as an int64 array
+        """
+        if self.single is not None:
+            return self.single[0]
+        base = self.block_last[j - 1] if j else 0
+        count = min(end * BLOCK_SIZE, self.df) - j * BLOCK_SIZE
+        return base + np.cumsum(self.values(int(self.block_offsets[j, 0]), count))
+
+    def decode(self, j, end):
+        """ Returns the doc ids and the tfs of the blocks [j, end) as lists
+        """
+        if self.single is not None:
+            return self.single[0].tolist(), self.single[1].tolist()
+        doc_ids = self.decode_ids(j, end)
+        return doc_ids.tolist(), self.values(int(self.block_offsets[j, 1]), len(doc_ids)).tolist()
+
+    def contains(self, doc_ids):
+        """ This function looks up doc ids in the postings. Only the blocks the ids fall into are decoded, the
+        others are skipped with the block table
+        inputs:
+        doc_ids - sorted int64 array
+        outputs:
+        output - bool array, True for the doc ids that have a posting
+        """
+        blocks = np.searchsorted(self.last, doc_ids)
+        keys, firsts = np.unique(blocks, return_index=True)
+        postings = self.single[0] if self.single is not None else None
+        if postings is None and 4 * len(keys) > len(self.last):
+            # The ids fall into most blocks: decoding all the doc id gaps at once is cheaper
+            postings = np.cumsum(self.values(0, self.df))
+        if postings is not None:
+            found = np.minimum(np.searchsorted(postings, doc_ids), len(postings) - 1)
+            return postings[found] == doc_ids
+        mask = np.zeros(len(doc_ids), dtype=bool)
+        bounds = np.append(firsts, len(doc_ids))
+        for key, lo, hi in zip(keys.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+            if key == len(self.last):
+                break
+            postings = self.decode_ids(key, key + 1)
+            found = np.minimum(np.searchsorted(postings, doc_ids[lo:hi]), len(postings) - 1)
+            mask[lo:hi] = postings[found] == doc_ids[lo:hi]
+        return mask
+
+
+def postings_arrays(inverted_index, word):
+    """ This function returns the postings of a word as sorted doc ids and tfs
+    inputs:
+    inverted_index - {word:[{page_id:[[position,..],tf,tf_norm]},idf]..} or an index object
+    outputs:
+    output - (doc ids as int64 array, tfs as int64 array)
+    """
+    if hasattr(inverted_index, 'postings_arrays'):
+        return inverted_index.postings_arrays(word)
+    postings = inverted_index[word][0] if word in inverted_index else {}
+    doc_ids = sorted(postings, key=int)
+    return (np.array([int(page_id) for page_id in doc_ids], dtype=np.int64),
+            np.array([postings[page_id][1] for page_id in doc_ids], dtype=np.int64))
+
+
+def postings_contain(inverted_index, word, doc_ids):
+    """ This function probes doc ids in the postings of a word. An index object skips the blocks of postings
+    none of the ids fall into; a plain dictionary is searched with its sorted doc ids
+    inputs:
+    doc_ids - sorted int64 array
+    outputs:
+    output - bool array, True for the doc ids that have a posting of word
+    """
+    if hasattr(inverted_index, 'contains'):
+        return inverted_index.contains(word, doc_ids)
+    postings = postings_arrays(inverted_index, word)[0]
+    if len(postings) == 0:
+        return np.zeros(len(doc_ids), dtype=bool)
+    found = np.minimum(np.searchsorted(postings, doc_ids), len(postings) - 1)
+    return postings[found] == doc_ids
+
+
+class JSONIndex(dict):
+    """ The JSON index, {word:[{page_id:[[position,..],tf,tf_norm]},idf]..}. It has no doc table: the ids of
+    its documents are collected from the postings the first time they are asked for
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.doc_ids = None
+        # Bitmap of the documents, built by the first NOT query
+        self.live_bitmap = None
+
+    def live_doc_ids(self):
+        if self.doc_ids is None:
+            page_ids = set()
+            for entry in self.values():
+                page_ids.update(entry[0])
+            self.doc_ids = np.array(sorted(int(page_id) for page_id in page_ids), dtype=np.int64)
+        return self.doc_ids
+
+
+def index_doc_ids(inverted_index):
+    """ This function returns the ids of the documents of an index; the postings of a plain dictionary are
+    scanned
+    outputs:
+    output - sorted int64 array
+    """
+    if hasattr(inverted_index, 'live_doc_ids'):
+        return inverted_index.live_doc_ids()
+    page_ids = set()
+    for word in inverted_index:
+        page_ids.update(inverted_index[word][0])
+    return np.array(sorted(int(page_id) for page_id in page_ids), dtype=np.int64)
+
+
+def index_doc_count(inverted_index):
+    # Number of documents of an index, from its doc table when it has one
+    if hasattr(inverted_index, 'total_doc'):
+        return inverted_index.total_doc
+    return len(index_doc_ids(inverted_index))
+
+
+def term_df(inverted_index, word):
+    # Document frequency of a word, without decoding the postings of an index object
+    if hasattr(inverted_index, 'df'):
+        return inverted_index.df(word)
+    return len(inverted_index[word][0]) if word in inverted_index else 0
+
+
+def term_idf(inverted_index, word):
+    # idf of a word, without decoding the postings of an index object
+    if hasattr(inverted_index, 'idf'):
+        return inverted_index.idf(word)
+    return inverted_index[word][1]
+
+
+def read_binary_index(path):
+    """ This function reads a binary index into the same structure as the JSON index
+    inputs:
+    path - path of binary index file as string
+    outputs:
+    content - {word:[{page_id:[[position,..],tf,tf_norm]},idf]..}
+    """
+    index = BinaryIndex(path, cache_size=0)
+    content = {}
+    for word in index:
+        content[word] = index[word]
+    return content
@@ -0,0 +1,153 @@
+import math
+import os
+import numpy as np
+import pytest
+import postings
+from postings import encode_varints, decode_varints, encode_postings, decode_postings, read_binary_index, BinaryIndex, \
+    finalize_terms, write_collection_stats, read_collection_stats
+from query import read_inverted_index
+
+# Folder of the test collections, the tests that build an index run in a temporary folder
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_varints():
+    values = [0, 1, 127, 128, 300, 2**21, 2**40 + 5]
+    buf = encode_varints(values)
+    assert len(encode_varints([127])) == 1 and len(encode_varints([128])) == 2
+    assert decode_varints(buf).tolist() == values
+    assert encode_varints([]) == b''
+
+
+def test_postings_round_trip():
+    postings = {'12': [[1, 4], 2, 0.4], '3': [[9, 0, 5], 3, 0.1], '2225': [[7], 1, 0.2]}
+    doc_ids, tfs, positions = decode_postings(encode_postings(postings), 3)
+    assert doc_ids.tolist() == [3, 12, 2225]
+    assert tfs.tolist() == [3, 2, 1]
+    assert [p.tolist() for p in positions] == [[0, 5, 9], [1, 4], [7]]
+
+
+def test_binary_index_matches_json(build):
+    build('small2.xml', 'index.dat', 'titles.dat')
+    build('small2.xml', 'index.bin', 'titles.dat')
+    assert read_binary_index(os.path.join('index', 'index.bin')) == read_inverted_index(os.path.join('index', 'index.dat'))
+    assert os.path.getsize(os.path.join('index', 'index.bin')) < os.path.getsize(os.path.join('index', 'index.dat')) / 2
+
+
+def test_binary_index_lazy(build):
+    expected = read_inverted_index(os.path.join(FOLDER, 'myindex.dat'))
+    build('small.xml', 'index.bin', 'titles.dat')
+    index = BinaryIndex(os.path.join('index', 'index.bin'), cache_size=2)
+    assert len(index.cache) == 0
+    assert 'clockwork' in index and 'clock' not in index and 'zzz' not in index and '' not in index
+    assert index['2001'] == expected['2001']
+    assert len(index.cache) == 1
+    assert sorted(index.keys()) == sorted(expected)
+    assert all(index[word] == expected[word] for word in expected)
+    assert len(index.cache) == 2
+    assert index.get('zzz') is None
+
+
+def test_finalize_terms():
+    doc_lengths = {'7': 4, '2': 2}
+    terms = [('a', {'7': [0, 3], '2': [1]}), ('b', {'7': [1]})]
+    sq_norms = {}
+    finalized = list(finalize_terms(terms, doc_lengths, sq_norms, chunk_size=1))
+    idf_b = -math.log(1 / 2)
+    assert [term[:3] for term in finalized] == [('a', {'7': [[0, 3], 2, 0.5], '2': [[1], 1, 0.5]}, 0.0),
+                                                ('b', {'7': [[1], 1, 0.25]}, idf_b)]
+    assert sq_norms == {'7': idf_b ** 2, '2': 0.0}
+    # Max BM25 contribution, average length 3: doc 2 (tf 1, length 2) for "a", doc 7 (tf 1, length 4) for "b"
+    bm25 = lambda tf, length, df: math.log(1 + (2 - df + 0.5) / (df + 0.5)) * tf * 2.2 / \
+        (tf + 1.2 * (0.25 + 0.75 * length / 3))
+    assert finalized[0][3][0].tolist() == [7] and finalized[1][3][0].tolist() == [7]
+    assert finalized[0][3][1] == pytest.approx([max(bm25(2, 4, 2), bm25(1, 2, 2))])
+    assert finalized[1][3][1] == pytest.approx([bm25(1, 4, 1)])
+
+
+def test_finalize_terms_blocks(monkeypatch):
+    monkeypatch.setattr(postings, 'BLOCK_SIZE', 2)
+    doc_lengths = {str(page_id): 10 for page_id in range(10)}
+    doc_lengths['8'] = 1
+    terms = [('a', {page_id: [0] for page_id in ['9', '8', '1', '4', '3']}), ('b', {'2': [0, 1]})]
+    (a, b) = [term[3] for term in finalize_terms(terms, doc_lengths, {})]
+    # Blocks of "a" in doc id order: [1, 3], [4, 8], [9]; doc 8 is the shortest, so its block scores highest
+    assert a[0].tolist() == [3, 8, 9] and b[0].tolist() == [2]
+    assert a[1][0] == a[1][2] < a[1][1]
+
+
+def test_collection_stats(tmp_path):
+    path = str(tmp_path / 'index.stats.json')
+    write_collection_stats(path, {'1': 3, '2': 5, '9': 10})
+    assert read_collection_stats(path) == {'N': 3, 'total_tokens': 18, 'avg_doc_length': 6.0}
+
+
+def test_binary_index_blocks(build, monkeypatch):
+    monkeypatch.setattr(postings, 'BLOCK_SIZE', 2)
+    build('small2.xml', 'index.bin', 'titles.dat')
+    index = BinaryIndex(os.path.join('index', 'index.bin'))
+    for word in index:
+        doc_ids, tfs = index.postings_arrays(word)
+        block_last, block_max = index.blocks(word)
+        assert len(block_last) == (len(doc_ids) + 1) // 2
+        assert block_last[:-1].tolist() == doc_ids[1::2][:len(block_last) - 1].tolist()
+        assert block_max.max() == index.max_score(word)
+        assert index.df(word) == len(doc_ids)
+        postings_by_id = sorted(index[word][0].items(), key=lambda item: int(item[0]))
+        assert tfs.tolist() == [posting[1] for page_id, posting in postings_by_id]
+        # Blocks are decoded one at a time with the byte offsets of the block table
+        lazy = index.block_postings(word)
+        assert len(lazy) == len(doc_ids)
+        assert lazy.block_last == block_last[:-1].tolist() + [doc_ids[-1]]
+        blocks = [lazy.decode(j, j + 1) for j in reversed(range(len(lazy.block_last)))][::-1]
+        assert sum([ids for ids, block_tfs in blocks], []) == doc_ids.tolist()
+        assert sum([block_tfs for ids, block_tfs in blocks], []) == tfs.tolist()
+        assert lazy.decode(0, len(lazy.block_last)) == (doc_ids.tolist(), tfs.tolist())
+        # Probing every id decodes the record at once, probing a few ids decodes their blocks only
+        probe = np.arange(doc_ids[-1] + 2)
+        assert index.contains(word, probe).tolist() == np.isin(probe, doc_ids).tolist()
+        assert index.contains(word, doc_ids[::4]).all()
+    assert index.block_postings('zzz') is None
+    assert not index.contains('zzz', np.array([0, 1])).any()
+
+
+def test_contains_skips_blocks(build, monkeypatch):
+    monkeypatch.setattr(postings, 'BLOCK_SIZE', 1)
+    build('small2.xml', 'index.bin', 'titles.dat')
+    index = BinaryIndex(os.path.join('index', 'index.bin'))
+    word = max(index, key=index.df)
+    doc_ids = index.postings_arrays(word)[0]
+    decoded = []
+    decode_ids = postings.BlockPostings.decode_ids
+    def counting_decode_ids(self, j, end):
+        decoded.append(j)
+        return decode_ids(self, j, end)
+    monkeypatch.setattr(postings.BlockPostings, 'decode_ids', counting_decode_ids)
+    assert len(doc_ids) >= 5
+    assert index.contains(word, doc_ids[3:4]).tolist() == [True]
+    # Only the block of doc_ids[3] is decoded, the others are skipped
+    assert decoded == [3]
+
+
+def test_binary_index_iter_postings(build):
+    build('small2.xml', 'index.bin', 'titles.dat')
+    index = BinaryIndex(os.path.join('index', 'index.bin'))
+    words = list(index)
+    chunks = list(index.iter_postings(chunk_size=3))
+    assert len(chunks) == (len(words) + 2) // 3
+    ordinals, doc_ids, tfs = (np.concatenate(arrays) for arrays in zip(*chunks))
+    for i, word in enumerate(words):
+        expected_ids, expected_tfs = index.postings_arrays(word)
+        assert doc_ids[ordinals == i].tolist() == expected_ids.tolist()
+        assert tfs[ordinals == i].tolist() == expected_tfs.tolist()
+
+
+def test_rebuild_keeps_open_index(build):
+    build('small.xml', 'index.bin', 'titles.dat')
+    index = BinaryIndex(os.path.join('index', 'index.bin'), cache_size=0)
+    expected = {word: index[word] for word in index}
+    build('small2.xml', 'index.bin', 'titles.dat')
+    # The open index still maps the file it was opened on
+    assert {word: index[word] for word in index} == expected
+    assert set(BinaryIndex(os.path.join('index', 'index.bin'))) != set(expected)
+    assert not [name for name in os.listdir('index') if name.endswith('.tmp')]
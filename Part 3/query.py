@@ -1,11 +1,28 @@
 import argparse
+import heapq
 import math
 import json
 import re
 import boolparser
-from nltk.stem import PorterStemmer
+from collections import Counter
+import numpy as np
+from postings import BinaryIndex, JSONIndex, read_doc_stats, read_collection_stats, postings_arrays, term_df, term_idf, \
+    postings_contain, index_doc_ids, index_doc_count, BM25_K1, BM25_B
+from segments import MANIFEST, SegmentedIndex
+from cache import LRUCache, StemCache
+from retrieval import ListPostings, TermCursor, BlockMaxCursor, wand_top_k, block_max_wand_top_k
+from matrix import MATRIX, CSRMatrix, matrix_path
+from bitmap import Bitmap
 import os
 import sys
+import time
+import multiprocessing
+
+# Shared by every query; main preloads it with the surface -> stem table written by create.py
+stem_cache = StemCache()
+
+# Number of results returned by top-k retrieval
+DEFAULT_TOP_K = 10
 
 def read_stopwords(stopwords_path):
     """ This function reads the stopwords file line by line, returning a list of the stopwords
@@ -47,10 +64,25 @@ def read_pagerank(index):
         output[page_id] = score
     return output
 
-def pagerank_match(matched_pages,pagerank_index):
+def select_top_k(scored,k=None,offset=0):
+    """ This function returns one page of ranked results with a bounded heap, in O(n log(offset+k)) instead of
+    sorting all of them. Documents with the same score keep their order
+    inputs:
+    scored - iterable of tuples [(page_id,score),..]
+    k - number of results of the page (all of them if None)
+    offset - number of best results skipped
+    outputs:
+    output - list of tuples [(page_id,score),..] sorted by score
+    """
+    if k is None:
+        return sorted(scored, key=lambda tup: tup[1], reverse=True)[offset:]
+    return heapq.nlargest(offset + k, scored, key=lambda tup: tup[1])[offset:]
+
+def pagerank_match(matched_pages,pagerank_index,k=None,offset=0):
     """ This function matches the :
     matched_pages - list of tuples [(page_id,score),..]
     pagerank_index - dictionary of page ids with their score as a value {page_id:score}
+    k, offset - page of results returned (all of them by default)
     outputs:
     output - ranked list of matched tuples [(page_id,score),..]
     """
@@ -60,7 +92,7 @@ def pagerank_match(matched_pages,pagerank_index):
             id = str(page)
             score = pagerank_index[id]
             matched.append((id,float(score)))
-    output = sorted(matched, key=lambda tup: tup[1], reverse=True)
+    output = select_top_k(matched,k,offset)
     return output
 
 def read_titles(titles):
@@ -150,12 +182,11 @@ def compare(a,b):
     output = []
     a_ind = 0
     b_ind = 0
-    len_a = len(a)
-    len_b = len(b)
+    if len(b) == 0:
+        return output
+    last_b = b[-1]
     while a_ind <= len(a)-1 and b_ind <= len(b)-1:
-        current_a = a[a_ind]
-        current_b = b[b_ind]
-        if a[a_ind] + 1 > max(b):
+        if a[a_ind] + 1 > last_b:
             break
         if a[a_ind] + 1 == b[b_ind]:
             output.append(b[b_ind])
@@ -167,18 +198,35 @@ def compare(a,b):
             b_ind += 1
     return output
 
-# def read_query_file(query_path):
-#     """ This function reads each query, line by line, and returns a list of queries as strings
-#     query_path — path of query file as a string
-#     outputs:
-#     content - list of query terms
-#     """
-#     f = open(query_path,'r')
-#     content = f.readlines()
-#     content = [line.strip('\n') for line in content]
-#     f.close()
-#     return content
-
+def match_phrase(positions):
+    """ This function finds a phrase with one merge over the position lists of its words: an occurrence is a
+    position p of the first word with p+1 in the list of the second word, p+2 in the list of the third, ..
+    Every list is walked forward only, so the cost is linear in the number of positions, and the lists are
+    not modified
+    inputs:
+    positions - sorted position lists, one per word of the phrase in phrase order
+    outputs:
+    output - position of the first word in the first occurrence, or -1
+    """
+    pointers = [0] * len(positions)
+    start = positions[0][0] if positions[0] else -1
+    i = 0
+    while i < len(positions) and start >= 0:
+        word_positions = positions[i]
+        target = start + i
+        p = pointers[i]
+        while p < len(word_positions) and word_positions[p] < target:
+            p += 1
+        pointers[i] = p
+        if p == len(word_positions):
+            return -1
+        if word_positions[p] == target:
+            i += 1
+        else:
+            # Word i is past the candidate: the next candidate starts i positions before it
+            start = word_positions[p] - i
+            i = 0
+    return start
 
 def read_inverted_index(inverted_index_path):
     """ This function
@@ -188,10 +236,318 @@ def read_inverted_index(inverted_index_path):
     content - {word:[{page_id:[[position,..],tf]},idf]..}
     """
     with open(inverted_index_path,'r') as f:
-        content = json.load(f)
+        content = JSONIndex(json.load(f))
     return content
 
 
+def open_index(index_folder):
+    """ This function opens the index of an index folder: all segments if incremental updates were applied,
+    otherwise the binary index, otherwise the JSON index
+    inputs:
+    index_folder – path of index folder as string (ending with a separator)
+    outputs:
+    content - {word:[{page_id:[[position,..],tf,tf_norm]},idf]..} or an object behaving like it
+    """
+    if os.path.exists(index_folder+MANIFEST):
+        return SegmentedIndex(index_folder)
+    if os.path.exists(index_folder+'myIndex.bin'):
+        return BinaryIndex(index_folder+'myIndex.bin')
+    return read_inverted_index(index_folder+'myIndex.dat')
+
+
+def index_token(index_folder):
+    """ This function identifies the current state of an index folder by the inode, size and modification time
+    of the manifest and of the base index files. They are all replaced with os.replace, so any update, merge
+    or rebuild changes the token
+    outputs:
+    output - tuple, compared with a previous token
+    """
+    token = []
+    for name in (MANIFEST,'myIndex.bin','myIndex.dat'):
+        try:
+            stat = os.stat(index_folder+name)
+            token.append((stat.st_ino,stat.st_size,stat.st_mtime_ns))
+        except FileNotFoundError:
+            token.append(None)
+    return tuple(token)
+
+
+def open_doc_stats(index_folder):
+    """ This function reads the per-document statistics written with the index of an index folder
+    inputs:
+    index_folder – path of index folder as string (ending with a separator)
+    outputs:
+    content - {page_id: (length, norm)}, or None for an index built without statistics
+    """
+    if os.path.exists(index_folder+MANIFEST):
+        return SegmentedIndex(index_folder).doc_stats()
+    if os.path.exists(index_folder+'myIndex.docstats'):
+        return read_doc_stats(index_folder+'myIndex.docstats')
+    return None
+
+
+def open_collection_stats(index_folder):
+    """ This function reads the collection statistics of an index folder
+    inputs:
+    index_folder – path of index folder as string (ending with a separator)
+    outputs:
+    content - {"N": int, "total_tokens": int, "avg_doc_length": float}, or None for an index built without them
+    """
+    if os.path.exists(index_folder+MANIFEST):
+        return SegmentedIndex(index_folder).collection_stats()
+    if os.path.exists(index_folder+'myIndex.stats.json'):
+        return read_collection_stats(index_folder+'myIndex.stats.json')
+    return None
+
+
+def check_index(index_folder,flag_rank):
+    """ This function checks that an index folder can be ranked with flag_rank, without loading it: BM25 needs
+    the statistics written by create.py, which the segments added by update.py always have
+    """
+    if flag_rank != 'bm25' or os.path.exists(index_folder+MANIFEST):
+        return
+    if not os.path.exists(index_folder+'myIndex.docstats') or not os.path.exists(index_folder+'myIndex.stats.json'):
+        raise ValueError("BM25 needs the document and collection statistics written by create.py")
+
+
+def open_csr_matrix(index_folder):
+    """ This function opens the document-term matrix written by create.py --csr, memory-mapped
+    inputs:
+    index_folder – path of index folder as string (ending with a separator)
+    outputs:
+    content - CSRMatrix, or None if there is none or it misses the segments added since
+    """
+    if os.path.exists(index_folder+MANIFEST) or not os.path.exists(matrix_path(index_folder+MATRIX,'terms')):
+        return None
+    return CSRMatrix(index_folder+MATRIX, mmap_mode='r')
+
+
+def rank_scores(matched_ids,scores,k=None,offset=0):
+    """ This function returns one page of matched ids ranked by their scores (stable for equal scores). With k
+    only the offset+k best scores, and the ones equal to the last of them, are sorted
+    inputs:
+    matched_ids - list of page ids
+    scores - float array aligned with matched_ids
+    outputs:
+    output - list of tuples [(page_id,score),..] sorted by score
+    """
+    n = len(scores) if k is None else min(offset + k, len(scores))
+    if 0 < n < len(scores):
+        threshold = np.partition(-scores, n - 1)[n - 1]
+        candidates = np.flatnonzero(-scores <= threshold)
+        ranking = candidates[np.argsort(-scores[candidates], kind='stable')][:n]
+    else:
+        ranking = np.argsort(-scores, kind='stable')
+    ranking = ranking[offset:] if k is None else ranking[offset:offset + k]
+    return [(str(matched_ids[i]), score) for i, score in zip(ranking.tolist(), scores[ranking].tolist())]
+
+
+def get_cosine_score(inverted_index,doc_stats,q_word,matched_ids=None,k=None,offset=0):
+    """ This function computes the cosine similarity between the query and the documents term at a time: the
+    postings of each query term are added into an accumulator and the dot products are divided by the
+    precomputed document norms, so only the postings of the query terms are read
+            inputs:
+            inverted_index – {word: [{page_id:[[position,..],tf,tf_norm]}, idf]   ..}
+            doc_stats – {page_id: (length, norm)}
+            q_word: ["snow","white"]
+            matched_ids: optional list of page ids to score (all documents containing a query term otherwise)
+            k, offset: page of results returned (all of them by default)
+            output:
+            [(page_id,score),(),...] sorted by score
+    """
+    q_weights = {}
+    for word in q_word:
+        if word in inverted_index:
+            q_weights[word] = q_weights.get(word,0) + inverted_index[word][1]
+    query_weight = math.sqrt(sum([w**2 for w in q_weights.values()]))
+
+    accumulator = {}
+    for word, q_weight in q_weights.items():
+        postings, idf = inverted_index[word]
+        for page_id, posting in postings.items():
+            accumulator[page_id] = accumulator.get(page_id,0) + posting[1]*idf*q_weight
+
+    if matched_ids is None:
+        matched_ids = list(accumulator)
+    output = []
+    for page_id in matched_ids:
+        page_id = str(page_id)
+        doc_weight = doc_stats[page_id][1] if page_id in doc_stats else 0
+        if page_id in accumulator and doc_weight > 0 and query_weight > 0:
+            output.append((page_id, accumulator[page_id]/(query_weight*doc_weight)))
+        else:
+            output.append((page_id, 0.0))
+    return select_top_k(output,k,offset)
+
+
+def bm25_idf(df,total_doc):
+    # Probabilistic idf of BM25, kept positive for terms in more than half of the documents
+    return math.log(1 + (total_doc - df + 0.5)/(df + 0.5))
+
+
+def get_bm25_score(inverted_index,doc_stats,collection_stats,q_word,matched_ids=None,k1=BM25_K1,b=BM25_B,k=None,
+                   offset=0):
+    """ This function computes the BM25 score of the documents term at a time, from the document lengths and
+    the average document length computed at index time
+            inputs:
+            inverted_index – {word: [{page_id:[[position,..],tf,tf_norm]}, idf]   ..}
+            doc_stats – {page_id: (length, norm)}
+            collection_stats – {"N": int, "avg_doc_length": float, ..}
+            q_word: ["snow","white"]
+            matched_ids: optional list of page ids to score (all documents containing a query term otherwise)
+            k1, b: term frequency saturation and length normalization parameters
+            k, offset: page of results returned (all of them by default)
+            output:
+            [(page_id,score),(),...] sorted by score
+    """
+    total_doc = collection_stats['N']
+    avg_length = collection_stats['avg_doc_length']
+    accumulator = {}
+    for word in q_word:
+        if word not in inverted_index:
+            continue
+        postings = inverted_index[word][0]
+        idf = bm25_idf(len(postings),total_doc)
+        for page_id, posting in postings.items():
+            tf = posting[1]
+            length_norm = 1 - b + b*doc_stats[page_id][0]/avg_length
+            accumulator[page_id] = accumulator.get(page_id,0) + idf*tf*(k1 + 1)/(tf + k1*length_norm)
+
+    if matched_ids is None:
+        matched_ids = list(accumulator)
+    output = [(str(page_id), accumulator.get(str(page_id),0.0)) for page_id in matched_ids]
+    return select_top_k(output,k,offset)
+
+
+def get_tfidf_score(inverted_index,q_word,matched_ids,doc_stats=None,k=None,offset=0):
+    """ This function ranks the matched documents by tf-idf cosine similarity with NumPy: the tfs of each query
+    term are gathered into an array aligned with matched_ids, and the scores are computed with array operations.
+    With doc_stats the documents are normalized by their precomputed norms (as get_cosine_score), otherwise by
+    the norm of their query term tfs (as get_tf_matrix and get_doc_score)
+            inputs:
+            inverted_index – {word: [{page_id:[[position,..],tf,tf_norm]}, idf]   ..} or an index object
+            q_word: ["snow","white"]
+            matched_ids: list of page ids to score
+            doc_stats – optional {page_id: (length, norm)}
+            k, offset: page of results returned (all of them by default)
+            output:
+            [(page_id,score),(),...] sorted by score
+    """
+    matched = np.array([int(page_id) for page_id in matched_ids], dtype=np.int64)
+    order = np.argsort(matched, kind='stable')
+    sorted_ids = matched[order]
+
+    columns = {}
+    idfs = {}
+    for word in q_word:
+        if word in columns:
+            continue
+        column = np.zeros(len(matched))
+        if word in inverted_index:
+            doc_ids, tfs = postings_arrays(inverted_index,word)
+            found = np.minimum(np.searchsorted(sorted_ids, doc_ids), max(len(matched) - 1, 0))
+            hit = sorted_ids[found] == doc_ids if len(matched) else np.zeros(len(doc_ids), dtype=bool)
+            column[order[found[hit]]] = tfs[hit]
+            idfs[word] = term_idf(inverted_index,word)
+        columns[word] = column
+
+    dot = np.zeros(len(matched))
+    if doc_stats is not None:
+        q_weights = {}
+        for word in q_word:
+            if word in idfs:
+                q_weights[word] = q_weights.get(word,0) + idfs[word]
+        for word, q_weight in q_weights.items():
+            dot += columns[word]*idfs[word]*q_weight
+        query_weight = math.sqrt(sum([w**2 for w in q_weights.values()]))
+        doc_weight = np.array([doc_stats[str(page_id)][1] if str(page_id) in doc_stats else 0.0
+                               for page_id in matched_ids])
+    else:
+        # One column per query token, as get_tf_matrix
+        sq = np.zeros(len(matched))
+        for word in q_word:
+            dot += idfs.get(word,0)*columns[word]
+            sq += columns[word]**2
+        query_weight = math.sqrt(sum([idfs.get(word,0)**2 for word in q_word]))
+        doc_weight = np.sqrt(sq)
+    denominator = query_weight*doc_weight
+    scores = np.divide(dot, denominator, out=np.zeros(len(matched)), where=denominator > 0)
+    return rank_scores(matched_ids,scores,k,offset)
+
+
+def get_csr_score(matrix,q_word,matched_ids,k=None,offset=0):
+    """ This function ranks the matched documents by tf-idf cosine similarity with one sparse matrix-vector
+    product over the document-term matrix
+            inputs:
+            matrix – CSRMatrix
+            q_word: ["snow","white"]
+            matched_ids: list of page ids to score
+            k, offset: page of results returned (all of them by default)
+            output:
+            [(page_id,score),(),...] sorted by score
+    """
+    cosine = matrix.cosine(q_word)
+    matched = np.array([int(page_id) for page_id in matched_ids], dtype=np.int64)
+    rows = np.minimum(np.searchsorted(matrix.docs, matched), max(len(matrix.docs) - 1, 0))
+    found = matrix.docs[rows] == matched if len(matrix.docs) else np.zeros(len(matched), dtype=bool)
+    scores = np.where(found, cosine[rows] if len(matrix.docs) else 0.0, 0.0)
+    return rank_scores(matched_ids,scores,k,offset)
+
+
+def get_bm25_top_k(inverted_index,doc_stats,collection_stats,q_word,k=DEFAULT_TOP_K,k1=BM25_K1,b=BM25_B,
+                   counters=None,block_max=False):
+    """ This function returns the k documents with the best BM25 score with WAND, or Block-Max WAND, without
+    scoring the documents that cannot make the top k. The upper bounds of a term are the max scores stored in
+    a binary index when they were computed with the same k1 and b, and idf*(k1+1) otherwise
+            inputs:
+            inverted_index – {word: [{page_id:[[position,..],tf,tf_norm]}, idf]   ..} or an index object
+            doc_stats – {page_id: (length, norm)}
+            collection_stats – {"N": int, "avg_doc_length": float, ..}
+            q_word: ["snow","white"]
+            k: number of documents to return
+            k1, b: term frequency saturation and length normalization parameters
+            counters: optional dictionary, 'scored' is increased by the number of scored documents
+            block_max: use the block max scores of the index to skip whole blocks of postings
+            output:
+            [(page_id,score),(),...] sorted by score
+    """
+    total_doc = collection_stats['N']
+    avg_length = collection_stats['avg_doc_length']
+    stored_bounds = hasattr(inverted_index,'max_score') and (k1, b) == (BM25_K1, BM25_B)
+    cursors = []
+    for word, count in Counter(q_word).items():
+        if hasattr(inverted_index,'block_postings'):
+            # A binary index decodes the blocks of postings the cursors reach
+            postings = inverted_index.block_postings(word)
+        else:
+            doc_ids, tfs = postings_arrays(inverted_index,word)
+            postings = ListPostings(doc_ids.tolist(),tfs.tolist()) if len(doc_ids) else None
+        if postings is None:
+            continue
+        weight = count*bm25_idf(len(postings),total_doc)
+        if stored_bounds:
+            upper_bound = count*inverted_index.max_score(word)
+        else:
+            upper_bound = weight*(k1 + 1)
+        if not block_max:
+            cursors.append(TermCursor(postings,weight,upper_bound))
+            continue
+        if stored_bounds and hasattr(inverted_index,'blocks'):
+            block_scores = (count*inverted_index.blocks(word)[1].astype(np.float64)).tolist()
+        else:
+            # Every block is bounded by the term: Block-Max WAND works like WAND
+            block_scores = [upper_bound]*len(postings.block_last)
+        cursors.append(BlockMaxCursor(postings,weight,upper_bound,block_scores))
+
+    def score(cursor,doc):
+        tf = cursor.tf()
+        length_norm = 1 - b + b*doc_stats[str(doc)][0]/avg_length
+        return cursor.weight*tf*(k1 + 1)/(tf + k1*length_norm)
+
+    top_k = block_max_wand_top_k if block_max else wand_top_k
+    return [(str(doc), value) for doc, value in top_k(cursors,k,score,counters)]
+
+
 def get_tf_matrix (matched_ids,inverted_index,q_word):
     """
             inputs:
@@ -226,7 +582,7 @@ def get_tf_matrix (matched_ids,inverted_index,q_word):
     return myArray
 
 
-def get_doc_score(doc_matrix,inverted_index,matched_ids,q_word):
+def get_doc_score(doc_matrix,inverted_index,matched_ids,q_word,k=None,offset=0):
     """
                 inputs:
                 matched_title: ["this title1", "this title2",...]
@@ -236,6 +592,7 @@ def get_doc_score(doc_matrix,inverted_index,matched_ids,q_word):
                     [tf doc2/word1,  tf doc2/word2, ...]
                     [tf doc3/word1,  tf doc3/word2, ...]
                      [...] ]
+                k, offset - page of results returned (all of them by default)
                 output:
                 [(title,score),(),...]
         """
@@ -251,13 +608,13 @@ def get_doc_score(doc_matrix,inverted_index,matched_ids,q_word):
 
     score=[]
     title_score = []
+    query_weight = math.sqrt(sum( [(q_list[j])**2 for j in range(len(q_list))] ) )
     for i, item in enumerate(doc_matrix):
         dot_product = sum( [q_list[j]*item[j] for j in range(len(item))] )
-        query_weight = math.sqrt(sum( [(q_list[j])**2 for j in range(len(q_list))] ) )
         doc_weight = math.sqrt(sum( [(item[j])**2 for j in range(len(item))] ) )
         score.append( dot_product/(query_weight * doc_weight) )
         title_score.append((matched_ids[i],score[i]) )
-        sorted_by_second = sorted(title_score, key=lambda tup: tup[1], reverse=True)
+    sorted_by_second = select_top_k(title_score,k,offset)
     #print(sorted_by_second)
     return sorted_by_second
 
@@ -290,8 +647,7 @@ class Query:
         self.query_string = remove_stop
 
     def stem(self):
-        ps = PorterStemmer()
-        self.query_string = [ps.stem(w) for w in self.query_string]
+        self.query_string = [stem_cache.stem(w) for w in self.query_string]
 
     def titles(self,rank):
         pass
@@ -324,7 +680,7 @@ class OneWordQuery(Query):
                 output.append(' ')
             return output
 
-    def vector_space(self,inverted_index,ids):
+    def vector_space(self,inverted_index,ids,k=None,offset=0):
         query = self.query_string[0]
         ids = list(map(str, ids))
         #print(ids)
@@ -337,7 +693,7 @@ class OneWordQuery(Query):
             output.append((id, score))
         #print(output)
         #print('\n')
-        sorted_by_score = sorted(output, key=lambda tup: tup[1], reverse=True)
+        sorted_by_score = select_top_k(output,k,offset)
         return sorted_by_score
 
 class FreeTextQuery(Query):
@@ -396,59 +752,30 @@ class PhraseQuery(Query):
         outputs:
         content - return a sorted list of matching document ids
         """
-
         if self.query_string == []:
-            output = [' ']
-        else:
-            total = []
-            # Extract position lists
-            for query in self.query_string:
-                x = [key for key in inverted_index[query][0].keys()]
-                total.append(set(x))
-
-            # Get intersecting positions
-            page_ids = set.intersection(*total)
-            page_ids = list(page_ids)
-            count = 0
-            output = []
-            dict_temp = {}
-            for w in range(len(self.query_string)):
-                if count == len(self.query_string)-1:
-                    if dict_temp == {}:
-                        output.append(' ')
-                    else:
-                        output.extend(list(dict_temp.keys()))
-                    break
-                token_1 = self.query_string[w]
-                token_2 = self.query_string[w+1]
-                #print(token_1)
-                #print(token_2)
-
-                if w >= 1:
-                    for p in page_ids:
-                        x = dict_temp
-                        if p in dict_temp:
-                            token_1_position = dict_temp[p]
-                            token_2_position = inverted_index[token_2][0][p][0]
-                            token_1_position.sort()
-                            token_2_position.sort()
-                            result = compare(token_1_position,token_2_position)
-                            if result != []:
-                                dict_temp[p]=result
-                            else:
-                                del dict_temp[p]
-                if w == 0:
-                    for p in page_ids:
-                        token_1_position = inverted_index[token_1][0][p][0]
-                        token_2_position= inverted_index[token_2][0][p][0]
-                        #print(token_1_position)
-                        #print(token_2_position)
-                        token_1_position.sort()
-                        token_2_position.sort()
-                        result = compare(token_1_position,token_2_position)
-                        if result != []:
-                            dict_temp[p] = result
-                count += 1
+            return [' ']
+        # Documents holding every word, rarest word first: the candidates only shrink, and the postings of the
+        # commoner words are not read once none is left
+        postings = {}
+        page_ids = None
+        for word in sorted(set(self.query_string),key=lambda word: term_df(inverted_index,word)):
+            entry = inverted_index.get(word)
+            if entry is None:
+                return [' ']
+            postings[word] = entry[0]
+            if page_ids is None:
+                page_ids = list(postings[word])
+            else:
+                page_ids = [page_id for page_id in page_ids if page_id in postings[word]]
+            if page_ids == []:
+                return [' ']
+
+        output = []
+        for page_id in sorted(page_ids,key=int):
+            if match_phrase([postings[word][page_id][0] for word in self.query_string]) >= 0:
+                output.append(page_id)
+        if output == []:
+            output.append(' ')
         return output
 
     def vector_space(self, inverted_index, ids):
@@ -461,21 +788,73 @@ class BooleanQuery(Query):
         super().__init__(query_string)
 
     def remove(self):
-        #print(self.query_string)
-        p = re.compile('\(|AND|OR|\)')
-        self.query_string=p.sub('',self.query_string)
+        # The negated operands are not query terms
+        try:
+            ast = boolparser.bool_expr_ast(self.query_string)
+            self.query_string = ' '.join(boolparser.positive_operands(ast))
+        except ValueError:
+            p = re.compile(r'\(|\bAND\b|\bOR\b|\bNOT\b|\)')
+            self.query_string=p.sub('',self.query_string)
 
     def match(self,inverted_index,stopwords):
-
+        """
+        outputs:
+        content - return a sorted list of matching int document ids
+        """
         ast = boolparser.bool_expr_ast(self.query_string)
         #print(ast)
         output= rec(ast,inverted_index,stopwords)
-        return output
+        return output.to_array().tolist()
 
     def vector_space(self, inverted_index, ids):
         pass
 
-def rec(ast,inverted_index,stopwords):
+def flatten_ast(ast):
+    """ This function merges nested nodes of the same operator, as left associative parsing builds them:
+    ('AND',[('AND',['a','b']),'c']) -> ('AND',['a','b','c']), and removes double negations
+    """
+    if isinstance(ast,str):
+        return ast
+    if ast[0] == 'NOT':
+        operand = flatten_ast(ast[1][0])
+        if isinstance(operand,tuple) and operand[0] == 'NOT':
+            return operand[1][0]
+        return 'NOT', [operand]
+    operands = []
+    for element in ast[1]:
+        element = flatten_ast(element)
+        if isinstance(element,tuple) and element[0] == ast[0]:
+            operands.extend(element[1])
+        else:
+            operands.append(element)
+    return ast[0], operands
+
+def plan_query(ast,inverted_index,stopwords):
+    """ This function turns a Boolean AST into a plan whose nodes carry their estimated number of matches:
+    the document frequency of a term, the smallest estimate of the operands of an AND, the sum of the
+    estimates of an OR and the collection size minus the estimate of the operand of a NOT (at least 1). AND
+    operands are sorted cheapest first, negated operands last
+    inputs:
+    ast - AST from boolparser.bool_expr_ast
+    outputs:
+    output - ('TERM',stemmed token or None,estimate), ('PHRASE',[stemmed token,..],estimate) or
+             (operator,[plan,..],estimate)
+    """
+    ast = flatten_ast(ast)
+    if isinstance(ast,str) and ast.startswith('"'):
+        query_obj = PhraseQuery(ast)
+        query_obj.remove()
+        query_obj.lower_q()
+        query_obj.obtain_tokens()
+        query_obj.filter_tokens(stopwords)
+        query_obj.stem()
+        if len(query_obj.query_string) == 0:
+            return 'TERM', None, 0
+        if len(query_obj.query_string) == 1:
+            token = query_obj.query_string[0]
+            return 'TERM', token, term_df(inverted_index,token)
+        # A phrase matches at most the documents of its rarest word
+        return 'PHRASE', query_obj.query_string, min(term_df(inverted_index,token) for token in query_obj.query_string)
 
     if isinstance(ast,str):
         # Get id of string (return id)
@@ -485,34 +864,99 @@ def rec(ast,inverted_index,stopwords):
         query_obj.obtain_tokens()
         query_obj.filter_tokens(stopwords)
         if len(query_obj.query_string) == 0:
-            return []
-        else:
-            query_obj.stem()
-            match_ids = query_obj.match(inverted_index)
-            if match_ids == [' ']:
-                match_ids = []
-            return match_ids
-
-    if isinstance(ast,tuple):
-        if ast[0] == "AND":
-            # do processing
-            total_list = []
-            for element in ast[1]:
-                single_list = rec(element,inverted_index,stopwords)
-                total_list.append(set(single_list))
-            page_ids = set.intersection(*total_list)
-            page_ids = list(page_ids)
-            return page_ids
-            # return union
-        else:
-            # ast[0] == 'OR'
-            total_list = []
-            for element in ast[1]:
-                single_list = rec(element, inverted_index, stopwords)
-                total_list.append(set(single_list))
-            page_ids = set.union(*total_list)
-            page_ids = list(page_ids)
-            return page_ids
+            return 'TERM', None, 0
+        query_obj.stem()
+        token = query_obj.query_string[0]
+        return 'TERM', token, term_df(inverted_index,token)
+
+    operands = [plan_query(element,inverted_index,stopwords) for element in ast[1]]
+    if ast[0] == 'AND':
+        # A negated operand is subtracted from the intersection of the others, never complemented
+        operands.sort(key=lambda plan: (plan[0] == 'NOT', plan[2]))
+        return 'AND', operands, min(plan[2] for plan in operands)
+    if ast[0] == 'NOT':
+        # df can overcount (deleted postings of a segmented index), so a complement is never estimated empty:
+        # only an estimate of 0 is exact, and run_plan prunes on it
+        return 'NOT', operands, max(index_doc_count(inverted_index) - operands[0][2], 1)
+    return 'OR', operands, sum(plan[2] for plan in operands)
+
+def run_plan(plan,inverted_index):
+    """ This function evaluates a plan on compressed bitmaps of doc ids. The operands of an AND are
+    intersected one at a time, cheapest first, and evaluation stops at the first empty intersection. A term
+    after the first operand is not decoded: the ids matched so far are probed in its postings, which skips
+    the blocks none of them fall into, so a rare term AND a frequent one costs the rare one; OR skips
+    the operands estimated empty. a AND NOT b removes the matches of b from those of a (a term b is probed
+    the same way, never decoded), and only a bare NOT is evaluated against the bitmap of all the documents
+    outputs:
+    output - Bitmap of the matching doc ids
+    """
+    if plan[0] == 'TERM':
+        if plan[1] is None:
+            return Bitmap()
+        return Bitmap.from_ids(postings_arrays(inverted_index,plan[1])[0])
+    if plan[0] == 'PHRASE':
+        if plan[2] == 0:
+            return Bitmap()
+        query_obj = PhraseQuery(plan[1])
+        return Bitmap.from_ids(sorted(int(page_id) for page_id in query_obj.match(inverted_index) if page_id != ' '))
+    if plan[0] == 'NOT':
+        return live_bitmap(inverted_index).andnot(run_plan(plan[1][0],inverted_index))
+    output = Bitmap()
+    if plan[0] == 'AND':
+        if plan[2] == 0:
+            return output
+        for i, operand in enumerate(plan[1]):
+            if i > 0 and operand[0] == 'NOT':
+                negated = operand[1][0]
+                if negated[0] == 'TERM' and negated[2] > 0:
+                    page_ids = output.to_array()
+                    output = Bitmap.from_ids(page_ids[~postings_contain(inverted_index,negated[1],page_ids)])
+                elif negated[2] > 0:
+                    output = output.andnot(run_plan(negated,inverted_index))
+            elif i > 0 and operand[0] == 'TERM':
+                page_ids = output.to_array()
+                output = Bitmap.from_ids(page_ids[postings_contain(inverted_index,operand[1],page_ids)])
+            else:
+                page_ids = run_plan(operand,inverted_index)
+                output = page_ids if i == 0 else output & page_ids
+            if not output:
+                break
+        return output
+    for operand in plan[1]:
+        if operand[2] > 0:
+            output = output | run_plan(operand,inverted_index)
+    return output
+
+def plan_key(plan):
+    """ This function returns a plan without its estimates, as nested tuples. The operands of AND and OR are
+    sorted, so queries that only differ in the order or the nesting of their operands share a key
+    """
+    if plan[0] == 'TERM':
+        return plan[0], plan[1]
+    if plan[0] == 'PHRASE':
+        return plan[0], tuple(plan[1])
+    operands = [plan_key(operand) for operand in plan[1]]
+    if plan[0] != 'NOT':
+        operands.sort(key=repr)
+    return plan[0], tuple(operands)
+
+def live_bitmap(inverted_index):
+    """ This function returns the bitmap of the documents of an index. It is built once and kept on the index
+    object, so it goes away with it; a plain dictionary gets a new one on every call
+    """
+    bitmap = getattr(inverted_index,'live_bitmap',None)
+    if bitmap is None:
+        bitmap = Bitmap.from_ids(index_doc_ids(inverted_index))
+        if hasattr(inverted_index,'live_bitmap'):
+            inverted_index.live_bitmap = bitmap
+    return bitmap
+
+def rec(ast,inverted_index,stopwords):
+    """ This function evaluates a Boolean AST through plan_query and run_plan
+    outputs:
+    output - Bitmap of the matching doc ids
+    """
+    return run_plan(plan_query(ast,inverted_index,stopwords),inverted_index)
 
 class QueryFactory:
     """ This class looks reads in the queries as a string and determines the appropriate class for each query
@@ -523,9 +967,9 @@ class QueryFactory:
     def create(query_string:str):
         if not query_string:
             return None
-        if list(query_string[0]) == ['"'] and list(query_string[-1])==['"']:
+        if list(query_string[0]) == ['"'] and list(query_string[-1])==['"'] and query_string.count('"') == 2:
             return PhraseQuery(query_string)
-        if any([t in query_string for t in ('(',')','AND','OR')]):
+        if re.search(r'[()]|\b(AND|OR|NOT)\b',query_string):
             return BooleanQuery(query_string)
         words = query_string.split()
         if len(words) == 1:
@@ -536,6 +980,30 @@ class QueryFactory:
             raise ValueError('This query string is not a valid type.')
 
 
+def rank_matches(flag_rank,query_obj,token_query,match_ids,inverted_index,doc_stats,collection_stats,pagerank_full,
+                 k1=BM25_K1,b=BM25_B,k=None,offset=0,matrix=None):
+    """ This function ranks the matches of a query with the ranking mode chosen on the command line
+    inputs:
+    flag_rank - 'pagerank', 'bm25' or 'tfidf' (None)
+    query_obj - the query, after its tokens were normalized
+    token_query - list of query tokens
+    match_ids - sorted list of matching page ids as int
+    k, offset - page of results returned (all of them by default)
+    matrix - optional CSRMatrix used for tf-idf ranking
+    outputs:
+    output - ranked list of tuples [(page_id,score),..]
+    """
+    if flag_rank == 'pagerank':
+        return pagerank_match(match_ids,pagerank_full,k,offset)
+    if flag_rank == 'bm25':
+        return get_bm25_score(inverted_index,doc_stats,collection_stats,token_query,match_ids,k1,b,k,offset)
+    if type(query_obj).__name__ == 'OneWordQuery':
+        return query_obj.vector_space(inverted_index,match_ids,k,offset)
+    if matrix is not None:
+        return get_csr_score(matrix,token_query,match_ids,k,offset)
+    return get_tfidf_score(inverted_index,token_query,match_ids,doc_stats,k,offset)
+
+
 def check_bool(string):
     # check boolean query has correct parentheses
     count = 0;
@@ -548,6 +1016,203 @@ def check_bool(string):
     else:
         return True
 
+class Searcher:
+    """ Runs queries against an index folder. The index, the statistics, the PageRank scores, the titles and the
+    stem table are loaded once; the ranking options apply to every query. Ranked results are kept in an LRU cache keyed
+    on the normalized query. The index is reopened, and the cache emptied, when the index folder changes
+    """
+    def __init__(self,stopwords_path,index_folder,flag_rank=None,k1=BM25_K1,b=BM25_B,retrieval='exhaustive',
+                 top_k=DEFAULT_TOP_K,offset=0,csr=False,cache_size=1024):
+        self.flag_rank = flag_rank
+        self.k1 = k1
+        self.b = b
+        self.retrieval = retrieval
+        self.top_k = top_k
+        self.offset = offset
+        self.stopwords = read_stopwords(stopwords_path)
+        self.index_folder = index_folder
+        self.csr = csr
+        self.results = LRUCache(cache_size)
+        self.token = index_token(index_folder)
+        check_index(index_folder,flag_rank)
+        self.load()
+
+    def load(self):
+        # Opens the index, its statistics, the PageRank scores, the titles and the document-term matrix (which is
+        # only used while the index has a single segment), and empties the result cache
+        self.inverted_index = open_index(self.index_folder)
+        if isinstance(self.inverted_index,SegmentedIndex):
+            # Only tf-idf ranking divides by the document norms
+            self.doc_stats = self.inverted_index.doc_stats(norms=self.flag_rank not in ('pagerank','bm25'))
+            self.collection_stats = self.inverted_index.collection_stats()
+        else:
+            self.doc_stats = open_doc_stats(self.index_folder)
+            self.collection_stats = open_collection_stats(self.index_folder)
+        self.pagerank_full = read_pagerank(self.index_folder+'score.dat')
+        titles_path = self.index_folder+'myTitles.dat'
+        self.titles = read_titles(titles_path) if os.path.exists(titles_path) else {}
+        if os.path.exists(self.index_folder+'myStems.dat'):
+            stem_cache.load(self.index_folder+'myStems.dat')
+        self.matrix = open_csr_matrix(self.index_folder) if self.csr else None
+        self.results.clear()
+
+    def refresh(self):
+        # Pick up segments added or merged, and rebuilds, since the last query
+        token = index_token(self.index_folder)
+        if token != self.token:
+            self.token = token
+            self.load()
+
+    def check(self,q):
+        """ Returns the error message of an invalid query, or None
+        """
+        query = q.replace('"',"").strip()
+        query = query.lower()
+        if query =="":
+            return "Error: Empty Input, Please enter query"
+        if query ==" ":
+            return "ERROR: Invalid space input, please enter query"
+        if query in self.stopwords:
+            return "ERROR: '%s' is a stop word, Please enter a valid input" % q
+        if "OR" or "AND" in query:
+            if not check_bool(query):
+                return "ERROR: Invalid Boolean Query, add a '(' or ')' "
+        return None
+
+    def search(self,q):
+        """ This function runs one query
+        inputs:
+        q - the query as typed
+        outputs:
+        output - (ranked list of tuples [(page_id,score),..], error message or None)
+        """
+        error = self.check(q)
+        if error is not None:
+            return [], error
+        self.refresh()
+        inverted_index = self.inverted_index
+
+        query_obj = QueryFactory.create(q)
+        if query_obj == None:
+            return [], None
+        query_type = type(query_obj).__name__
+        query_obj.remove()
+        query_obj.lower_q()
+        query_obj.obtain_tokens()
+        query_obj.filter_tokens(self.stopwords)
+        query_obj.stem()
+        token_query = query_obj.query_string
+        # The tokens of a Boolean query lose its operators, so it is keyed on its plan
+        query_key = tuple(token_query)
+        if query_type == 'BooleanQuery':
+            try:
+                plan = plan_query(boolparser.bool_expr_ast(q),inverted_index,self.stopwords)
+            except ValueError as e:
+                return [], "ERROR: Invalid Boolean Query, %s" % e
+            query_key = plan_key(plan)
+        key = (query_type, query_key, self.flag_rank, self.k1, self.b, self.retrieval, self.top_k, self.offset,
+               self.matrix is not None)
+        ranked = self.results.get(key)
+        if ranked is not None:
+            return list(ranked), None
+
+        if query_type == 'BooleanQuery':
+            match_ids = run_plan(plan,inverted_index).to_array().tolist()
+        if self.retrieval in ('wand','bmw') and self.flag_rank == 'bm25' and \
+                type(query_obj).__name__ in ('OneWordQuery','FreeTextQuery'):
+            match_ids = None
+        elif type(query_obj).__name__ != 'BooleanQuery':
+            match_ids = query_obj.match(inverted_index) # Give you the matched doc id by call match function
+            if match_ids[0] == ' ':
+                match_ids = []
+        if match_ids is None:
+            ranked = get_bm25_top_k(inverted_index,self.doc_stats,self.collection_stats,token_query,
+                                    self.offset + self.top_k,self.k1,self.b,
+                                    block_max=self.retrieval == 'bmw')[self.offset:]
+        elif match_ids == []:
+            ranked = []
+        else:
+            match_ids = [int(x) for x in match_ids]
+            match_ids.sort()
+            ranked = rank_matches(self.flag_rank,query_obj,token_query,match_ids,inverted_index,self.doc_stats,
+                                  self.collection_stats,self.pagerank_full,self.k1,self.b,self.top_k,self.offset,
+                                  self.matrix)
+        self.results.put(key, list(ranked))
+        return ranked, None
+
+
+def read_query_file(query_path):
+    """ This function reads each query, line by line, and returns a list of queries as strings
+    query_path — path of query file as a string
+    outputs:
+    content - list of query strings
+    """
+    with open(query_path,'r') as f:
+        content = [line.rstrip('\n') for line in f]
+    return content
+
+
+# Searcher of a batch worker process, built once by init_searcher, or the one of a single-worker batch
+worker_searcher = None
+
+def init_searcher(options):
+    global worker_searcher
+    worker_searcher = Searcher(**options)
+
+def timed_search(q):
+    """ This function runs one query of a batch in the current worker
+    outputs:
+    output - {"query": str, "ids": [page_id,..], "scores": [score,..], "time_ms": float, "cached": bool,
+              "error": str or None}
+    """
+    hits = worker_searcher.results.hits
+    start = time.perf_counter()
+    try:
+        ranked, error = worker_searcher.search(q)
+    except Exception as e:
+        # One failing query does not stop the batch
+        ranked, error = [], "ERROR: {}: {}".format(type(e).__name__, e)
+    elapsed = time.perf_counter() - start
+    return {'query': q,
+            'ids': [str(page_id) for page_id, score in ranked],
+            'scores': [float(score) for page_id, score in ranked],
+            'time_ms': elapsed*1000,
+            'cached': worker_searcher.results.hits > hits,
+            'error': error}
+
+def run_batch(queries,output_path,options,workers=1,searcher=None):
+    """ This function runs a list of queries and writes one JSON object per line, in the order of the queries.
+    With several workers every process loads the index once and queries are sent to them in chunks; a single
+    worker runs them in this process
+    inputs:
+    queries - list of query strings
+    output_path - path of the JSON lines file
+    options - keyword arguments of Searcher
+    workers - number of processes running queries
+    searcher - Searcher used by a single worker, built from options if None
+    outputs:
+    output - (list of the query times in ms, number of queries answered from a result cache)
+    """
+    global worker_searcher
+    times = []
+    cached = 0
+    with open(output_path,'w') as f:
+        if workers > 1:
+            with multiprocessing.Pool(workers,initializer=init_searcher,initargs=(options,)) as pool:
+                for result in pool.imap(timed_search,queries,chunksize=8):
+                    f.write(json.dumps(result) + '\n')
+                    times.append(result['time_ms'])
+                    cached += result['cached']
+        else:
+            worker_searcher = searcher if searcher is not None else Searcher(**options)
+            for q in queries:
+                result = timed_search(q)
+                f.write(json.dumps(result) + '\n')
+                times.append(result['time_ms'])
+                cached += result['cached']
+    return times, cached
+
+
 def main():
 
     #Create ArgumentParser object
@@ -557,119 +1222,84 @@ def main():
 
     parser.add_argument('my_stopwords', help='Path to stopwords dat file')
     parser.add_argument('index_folder', help='Path to index dat file')
-    parser.add_argument("--ranked", nargs='?', dest='flag_rank', help='pagerank')
+    parser.add_argument("--ranked", nargs='?', dest='flag_rank', help='tfidf (default), pagerank or bm25')
+    parser.add_argument("--k1", type=float, default=BM25_K1, help="BM25 term frequency saturation")
+    parser.add_argument("--b", type=float, default=BM25_B, help="BM25 document length normalization")
+    parser.add_argument("--retrieval", choices=['exhaustive', 'wand', 'bmw'], default='exhaustive',
+                        help="wand or bmw (Block-Max WAND), with --ranked bm25: return the best BM25 matches of free "
+                             "text queries without scoring the whole union of their postings")
+    parser.add_argument("--top-k", dest='top_k', type=int, default=DEFAULT_TOP_K,
+                        help="Number of results per query (default %d)" % DEFAULT_TOP_K)
+    parser.add_argument("--offset", type=int, default=0, help="Number of best results skipped, for pagination")
+    parser.add_argument("--csr", action='store_true',
+                        help="Rank tf-idf queries with the document-term matrix written by create.py --csr")
+    parser.add_argument("--queries", help="Batch mode: file of queries, one per line")
+    parser.add_argument("--output", help="Batch mode: JSON lines file of the results")
+    parser.add_argument("--workers", type=int, default=1, help="Batch mode: number of processes running queries")
+    parser.add_argument("--cache-size", dest='cache_size', type=int, default=1024,
+                        help="Number of query results kept in the result cache (0 disables it)")
     parser.add_argument("-t", dest='flag_t', help="print out titles", action="store_const", const=True)
     parser.add_argument("-v", dest='flag_v', help="print out titles", action="store_const", const=True)
     args = parser.parse_args()
+    if args.retrieval != 'exhaustive' and args.flag_rank != 'bm25':
+        parser.error("--retrieval {} ranks with BM25, it needs --ranked bm25".format(args.retrieval))
+    if args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    if args.offset < 0:
+        parser.error("--offset must not be negative")
 
     print("~ Stopwords path: {}".format(args.my_stopwords))
     print("~ Index folder".format(args.index_folder))
 
-    titles = args.index_folder+'myTitles.dat'
-    index = args.index_folder+'myIndex.dat'
-    pagerank_index = args.index_folder+'score.dat'
-
-    stopwords = read_stopwords(args.my_stopwords)
-    inverted_index = read_inverted_index(index)
-    titles_dict = read_titles(titles)
-    pagerank_full = read_pagerank(pagerank_index)
+    options = {'stopwords_path': args.my_stopwords, 'index_folder': args.index_folder,
+               'flag_rank': args.flag_rank, 'k1': args.k1, 'b': args.b, 'retrieval': args.retrieval,
+               'top_k': args.top_k, 'offset': args.offset, 'csr': args.csr, 'cache_size': args.cache_size}
+    if args.queries and not args.output:
+        print("ERROR: --queries needs an --output file")
+        return
+    searcher = None
+    try:
+        if args.queries and args.workers > 1:
+            # Every worker process loads the index, it is not loaded here
+            check_index(args.index_folder,args.flag_rank)
+        else:
+            searcher = Searcher(**options)
+    except ValueError as e:
+        print("ERROR: {}".format(e))
+        return
+    if args.csr and searcher is not None and searcher.matrix is None:
+        print("~ No up-to-date document-term matrix, ranking from the index")
+
+    if args.queries:
+        queries = read_query_file(args.queries)
+        start = time.perf_counter()
+        times, cached = run_batch(queries,args.output,options,args.workers,searcher)
+        elapsed = time.perf_counter() - start
+        times.sort()
+        print("~ Queries: {}, time: {:.2f}s, result cache hits: {}".format(len(times), elapsed, cached))
+        if times:
+            print("~ Query time (ms): median {:.2f}, p99 {:.2f}".format(times[len(times)//2],
+                                                                      times[min(len(times)-1, len(times)*99//100)]))
+        return
 
     while True:
         q = input("Query: ")
-        query = q.replace('"',"").strip()
-        query = query.lower()
-        if query =="":
-            print("Error: Empty Input, Please enter query")
+        ranked, error = searcher.search(q)
+        if error is not None:
+            print(error)
             continue
-        if query ==" ":
-            print("ERROR: Invalid space input, please enter query")
-            continue
-        if query in stopwords:
-            print("ERROR: '%s' is a stop word, Please enter a valid input" % q)
+        if ranked == []:
+            print(' ')
             continue
-        if "OR" or "AND" in query:
-            if not check_bool(query):
-                print("ERROR: Invalid Boolean Query, add a '(' or ')' ")
-                continue
-
-        #for q in query:
-        query_obj = QueryFactory.create(q)
-        if type(query_obj).__name__ == 'BooleanQuery':
-            initial = query_obj.query_string
-            match_ids = query_obj.match(inverted_index,stopwords)
-            query_obj.remove()
-            query_obj.lower_q()
-            query_obj.obtain_tokens()
-            query_obj.filter_tokens(stopwords)
-            query_obj.stem()
-            token_query = query_obj.query_string
-            if match_ids == []:
-                #print(initial)
-                print(' ')
-            else:
-                # FLAG Output: if -v: output title & score; if -t: output title; if nothing: output doc id;
-                match_ids = [int(x) for x in match_ids]
-                match_ids.sort()
-                if args.flag_rank == 'pagerank':
-                    ranked = pagerank_match(match_ids,pagerank_full)
-                if args.flag_rank == 'tfidf' or args.flag_rank == None:
-                    myArray = get_tf_matrix(match_ids,inverted_index,token_query)
-                    ranked = get_doc_score(myArray,inverted_index,match_ids,token_query)
-                if args.flag_v:
-                ############################Try to get a list of query tokens before running the codes below ##################
-                    titles = match_title(titles_dict,ranked)
-                    print_title_score(titles)
-                elif args.flag_t:
-                    titles = match_title(titles_dict,ranked)
-                    print_title(titles)
-                else:
-                    print_ids(ranked)
+        # FLAG Output: if -v: output title & score; if -t: output title; if nothing: output doc id;
+        if args.flag_v:
+            titles = match_title(searcher.titles,ranked)
+            print_title_score(titles)
+        elif args.flag_t:
+            titles = match_title(searcher.titles,ranked)
+            print_title(titles)
         else:
-            if query_obj == None:
-                #print('Empty Query')
-                print(' ')
-            else:
-                query_obj.remove()
-                query_obj.lower_q()
-                query_obj.obtain_tokens()
-                query_obj.filter_tokens(stopwords)
-                query_obj.stem()
-                token_query = query_obj.query_string
-                match_ids = query_obj.match(inverted_index) # Give you the matched doc id by call match function
-                if match_ids[0] == ' ':
-                    print(' ')
-                elif type(query_obj).__name__ == 'OneWordQuery':
-                    match_ids = [int(x) for x in match_ids]
-                    match_ids.sort()
-                    if args.flag_rank == 'pagerank':
-                        ranked = pagerank_match(match_ids, pagerank_full)
-                    if args.flag_rank == 'tfidf' or args.flag_rank == None:
-                        ranked = query_obj.vector_space(inverted_index,match_ids) #give you score
-                    if args.flag_v:
-                        titles = match_title(titles_dict,ranked)
-                        print_title_score(titles)
-                    elif args.flag_t:
-                        titles = match_title(titles_dict,ranked)
-                        print_title(titles)
-                    else:
-                        print_ids(ranked)
-                else:
-                    match_ids = [int(x) for x in match_ids]
-                    match_ids.sort()
-                    if args.flag_rank == 'pagerank':
-                        ranked = pagerank_match(match_ids, pagerank_full)
-                    if args.flag_rank == 'tfidf' or args.flag_rank == None:
-                        myArray = get_tf_matrix(match_ids,inverted_index,token_query)
-                        ranked = get_doc_score(myArray,inverted_index,match_ids,token_query)
-                    # # FLAG Output: if -v: output title & score; if -t: output title; if nothing: output doc id;
-                    if args.flag_v:
-                        titles = match_title(titles_dict,ranked)
-                        print_title_score(titles)
-                    elif args.flag_t:
-                        titles = match_title(titles_dict,ranked)
-                        print_title(titles)
-                    else:
-                        print_ids(ranked)
+            print_ids(ranked)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,213 @@
+import bisect
+import heapq
+import sys
+
+# Doc id of an exhausted cursor, greater than any page id
+END = sys.maxsize
+# Most blocks a cursor decodes at once
+MAX_RUN = 64
+
+
+class ListPostings:
+    """ Postings held as a doc id list and a tf list, cut into blocks of block_size postings (one block by
+    default). It reads like postings.BlockPostings: block_last holds the last doc id of every block and decode
+    returns the doc ids and the tfs of a range of blocks
+    """
+    def __init__(self, doc_ids, tfs, block_size=None):
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.block_size = block_size if block_size else max(len(doc_ids), 1)
+        self.block_last = [doc_ids[min(start + self.block_size, len(doc_ids)) - 1]
+                           for start in range(0, len(doc_ids), self.block_size)]
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def decode(self, j, end):
+        start = j * self.block_size
+        end *= self.block_size
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+
+class TermCursor:
+    """ Walks the postings of one query term in doc id order. Only the blocks the cursor reaches are decoded:
+    advance jumps over the blocks that end before its target without decoding them, and a cursor that reads
+    its blocks one after the other decodes twice as many of them at every step (up to MAX_RUN), so a scan
+    takes few decode calls. upper_bound is the highest score the term can add to a document; it is what lets
+    WAND skip documents
+    """
+    def __init__(self, postings, weight, upper_bound):
+        self.postings = postings
+        self.block_last = postings.block_last
+        self.weight = weight
+        self.upper_bound = upper_bound
+        self.run = 1
+        self.end = None
+        self.load(0)
+
+    def load(self, j):
+        # Decodes the blocks [j, end) and moves to the first document of block j
+        self.run = min(2 * self.run, MAX_RUN) if j == self.end else 1
+        self.end = min(j + self.run, len(self.block_last))
+        self.doc_ids, self.tfs = self.postings.decode(j, self.end) if j < self.end else ([], [])
+        self.pos = 0
+
+    def doc(self):
+        return self.doc_ids[self.pos] if self.pos < len(self.doc_ids) else END
+
+    def tf(self):
+        return self.tfs[self.pos]
+
+    def next(self):
+        self.pos += 1
+        if self.pos == len(self.doc_ids) and self.end < len(self.block_last):
+            self.load(self.end)
+
+    def advance(self, target):
+        """ Moves to the first document >= target
+        """
+        if self.doc() >= target:
+            return
+        if target > self.block_last[self.end - 1]:
+            self.load(bisect.bisect_left(self.block_last, target, self.end))
+        self.pos = bisect.bisect_left(self.doc_ids, target, self.pos)
+
+
+def wand_top_k(cursors, k, score, counters=None):
+    """ This function returns the k best documents with WAND: the cursors are kept sorted by their current
+    document, and the first document (the pivot) where the summed upper bounds of the cursors up to it beat the
+    k-th best score so far is the only one that can enter the top k. Cursors behind the pivot skip to it, and a
+    document is scored only when all the cursors before the pivot are on it
+    inputs:
+    cursors - list of TermCursor, one per query term
+    k - number of documents to return
+    score - function (cursor, doc id) -> contribution of the cursor's term to the document
+    counters - optional dictionary, 'scored' is increased by the number of fully scored documents
+    outputs:
+    output - list of tuples [(doc id,score),..] sorted by score
+    """
+    top = []
+    threshold = 0.0
+    scored = 0
+    cursors = [cursor for cursor in cursors if cursor.doc() != END]
+    while cursors and k > 0:
+        cursors.sort(key=lambda cursor: cursor.doc())
+        bound = 0.0
+        pivot = None
+        for i, cursor in enumerate(cursors):
+            bound += cursor.upper_bound
+            if bound > threshold or len(top) < k:
+                pivot = i
+                break
+        if pivot is None:
+            break
+        pivot_doc = cursors[pivot].doc()
+        if pivot_doc == END:
+            break
+        if cursors[0].doc() == pivot_doc:
+            total = 0.0
+            for cursor in cursors:
+                if cursor.doc() != pivot_doc:
+                    break
+                total += score(cursor, pivot_doc)
+                cursor.next()
+            scored += 1
+            if len(top) < k:
+                heapq.heappush(top, (total, -pivot_doc))
+            elif total > threshold:
+                heapq.heapreplace(top, (total, -pivot_doc))
+            if len(top) == k:
+                threshold = top[0][0]
+        else:
+            for cursor in cursors[:pivot]:
+                cursor.advance(pivot_doc)
+        cursors = [cursor for cursor in cursors if cursor.doc() != END]
+    if counters is not None:
+        counters['scored'] = counters.get('scored', 0) + scored
+    return [(-doc, total) for total, doc in sorted(top, reverse=True)]
+
+
+class BlockMaxCursor(TermCursor):
+    """ TermCursor that also knows the highest score the term adds to a document of every block of its
+    postings. The block boundaries double as skip pointers: a cursor moved to a block's end + 1 skips the whole
+    block without decoding it
+    """
+    def __init__(self, postings, weight, upper_bound, block_max):
+        super().__init__(postings, weight, upper_bound)
+        self.block_max = block_max
+        self.block = 0
+
+    def shallow_advance(self, target):
+        """ Moves the block pointer, not the cursor, to the block that may hold target
+        """
+        self.block = bisect.bisect_left(self.block_last, target, self.block)
+
+    def block_bound(self):
+        return self.block_max[self.block] if self.block < len(self.block_max) else 0.0
+
+    def block_end(self):
+        return self.block_last[self.block] if self.block < len(self.block_last) else END
+
+
+def block_max_wand_top_k(cursors, k, score, counters=None):
+    """ This function returns the k best documents with Block-Max WAND. The pivot is found with the term upper
+    bounds as in WAND, then checked against the max scores of the blocks that hold it: if they cannot beat the
+    k-th best score, every cursor up to the pivot jumps past the end of the nearest of these blocks instead of
+    scoring the pivot
+    inputs:
+    cursors - list of BlockMaxCursor, one per query term
+    k - number of documents to return
+    score - function (cursor, doc id) -> contribution of the cursor's term to the document
+    counters - optional dictionary, 'scored' is increased by the number of fully scored documents
+    outputs:
+    output - list of tuples [(doc id,score),..] sorted by score
+    """
+    top = []
+    threshold = 0.0
+    scored = 0
+    cursors = [cursor for cursor in cursors if cursor.doc() != END]
+    while cursors and k > 0:
+        cursors.sort(key=lambda cursor: cursor.doc())
+        bound = 0.0
+        pivot = None
+        for i, cursor in enumerate(cursors):
+            bound += cursor.upper_bound
+            if bound > threshold or len(top) < k:
+                pivot = i
+                break
+        if pivot is None:
+            break
+        pivot_doc = cursors[pivot].doc()
+        # Every cursor on the pivot document takes part in its score
+        while pivot + 1 < len(cursors) and cursors[pivot + 1].doc() == pivot_doc:
+            pivot += 1
+        block_bound = 0.0
+        for cursor in cursors[:pivot + 1]:
+            cursor.shallow_advance(pivot_doc)
+            block_bound += cursor.block_bound()
+        if block_bound > threshold or len(top) < k:
+            if cursors[0].doc() == pivot_doc:
+                total = 0.0
+                for cursor in cursors[:pivot + 1]:
+                    total += score(cursor, pivot_doc)
+                    cursor.next()
+                scored += 1
+                if len(top) < k:
+                    heapq.heappush(top, (total, -pivot_doc))
+                elif total > threshold:
+                    heapq.heapreplace(top, (total, -pivot_doc))
+                if len(top) == k:
+                    threshold = top[0][0]
+            else:
+                for cursor in cursors[:pivot]:
+                    cursor.advance(pivot_doc)
+        else:
+            target = min(cursor.block_end() for cursor in cursors[:pivot + 1]) + 1
+            if pivot + 1 < len(cursors):
+                target = min(target, cursors[pivot + 1].doc())
+            for cursor in cursors[:pivot + 1]:
+                cursor.advance(target)
+        cursors = [cursor for cursor in cursors if cursor.doc() != END]
+    if counters is not None:
+        counters['scored'] = counters.get('scored', 0) + scored
+    return [(-doc, total) for total, doc in sorted(top, reverse=True)]
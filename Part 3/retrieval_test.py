@@ -0,0 +1,86 @@
+import random
+from retrieval import ListPostings, TermCursor, BlockMaxCursor, wand_top_k, block_max_wand_top_k, END
+
+
+def test_cursor():
+    for block_size in (None, 1, 2, 3):
+        cursor = TermCursor(ListPostings([2, 5, 9, 14], [1, 3, 1, 2], block_size), 1.0, 3.0)
+        assert cursor.doc() == 2
+        cursor.advance(6)
+        assert (cursor.doc(), cursor.tf()) == (9, 1)
+        cursor.advance(9)
+        assert cursor.doc() == 9
+        cursor.next()
+        assert (cursor.doc(), cursor.tf()) == (14, 2)
+        cursor.advance(100)
+        assert cursor.doc() == END
+
+
+def test_cursor_skips_blocks():
+    decoded = []
+
+    class CountedPostings(ListPostings):
+        def decode(self, j, end):
+            decoded.append((j, end))
+            return super().decode(j, end)
+
+    cursor = TermCursor(CountedPostings(list(range(0, 400, 2)), [1] * 200, 10), 1.0, 1.0)
+    cursor.advance(151)
+    assert cursor.doc() == 152
+    for _ in range(9):
+        cursor.next()
+    assert cursor.doc() == 170
+    # Blocks 1 to 6 are skipped with their last doc ids, then blocks read in turn are decoded in longer runs
+    assert decoded == [(0, 1), (7, 8), (8, 10)]
+    cursor.advance(300)
+    assert cursor.doc() == 300 and decoded[-1] == (15, 16)
+
+
+def test_wand_top_k():
+    rng = random.Random(7)
+    postings = []
+    for df in (5000, 300, 40):
+        doc_ids = sorted(rng.sample(range(20000), df))
+        postings.append((doc_ids, [rng.randint(1, 5) for _ in doc_ids], 20000 / df))
+    expected = {}
+    for doc_ids, tfs, weight in postings:
+        for doc, tf in zip(doc_ids, tfs):
+            expected[doc] = expected.get(doc, 0) + weight * tf
+    expected = sorted(sorted(expected.items()), key=lambda tup: tup[1], reverse=True)
+
+    counters = {}
+    cursors = [TermCursor(ListPostings(doc_ids, tfs, 64), weight, weight * 5) for doc_ids, tfs, weight in postings]
+    ranked = wand_top_k(cursors, 10, lambda cursor, doc: cursor.weight * cursor.tf(), counters)
+    assert ranked == expected[:10]
+    # Documents that only contain the common term cannot beat the threshold
+    assert counters['scored'] < len(expected) / 10
+    assert wand_top_k([TermCursor(ListPostings([], []), 1.0, 1.0)], 10, lambda cursor, doc: 1.0) == []
+
+
+def test_block_max_wand_top_k():
+    rng = random.Random(11)
+    postings = []
+    for df in (8000, 6000, 500):
+        doc_ids = sorted(rng.sample(range(20000), df))
+        postings.append((doc_ids, [8 if rng.random() < 0.005 else 1 for _ in doc_ids], 20000 / df))
+    expected = {}
+    for doc_ids, tfs, weight in postings:
+        for doc, tf in zip(doc_ids, tfs):
+            expected[doc] = expected.get(doc, 0) + weight * tf
+    expected = sorted(sorted(expected.items()), key=lambda tup: tup[1], reverse=True)
+
+    def cursors(block_size):
+        output = []
+        for doc_ids, tfs, weight in postings:
+            block_max = [weight * max(tfs[start:start + block_size]) for start in range(0, len(doc_ids), block_size)]
+            output.append(BlockMaxCursor(ListPostings(doc_ids, tfs, block_size), weight, max(block_max), block_max))
+        return output
+
+    score = lambda cursor, doc: cursor.weight * cursor.tf()
+    wand = {}
+    assert wand_top_k(cursors(64), 10, score, wand) == expected[:10]
+    bmw = {}
+    assert block_max_wand_top_k(cursors(64), 10, score, bmw) == expected[:10]
+    assert bmw['scored'] < wand['scored']
+    # One block per term is WAND
+    assert block_max_wand_top_k(cursors(10 ** 6), 10, score) == expected[:10]
@@ -0,0 +1,450 @@
+import contextlib
+import heapq
+import json
+import math
+import os
+import threading
+import numpy as np
+from cache import LRUCache
+from postings import BinaryIndex, write_binary_index, finalize_terms, write_doc_stats, doc_stats_path, write_norms, \
+    norms_path, write_collection_stats, collection_stats_path
+
+# The manifest lists the segments of an index folder, oldest first:
+#   {"generation": 3, "segments": [{"name": "myIndex.bin", "deleted": []},
+#                                  {"name": "seg_000003.bin", "deleted": [12, 40]}]}
+# "deleted" holds the tombstones written with a segment: ids of documents that are deleted, or replaced by a
+# newer version, in the segments listed before it. Tombstones never hide documents of their own segment.
+# "retired" lists the files replaced by the last merge; they are removed by the next one, so a reader that
+# read the previous manifest can still open them.
+MANIFEST = 'segments.json'
+BASE_SEGMENT = 'myIndex.bin'
+# Lock file of the processes that change the manifest
+LOCK = 'segments.lock'
+# Record locks only exclude other processes, the threads of a process also take this lock
+THREAD_LOCK = threading.Lock()
+
+
+def segment_name(generation):
+    return 'seg_%06d.bin' % generation
+
+
+def read_manifest(index_folder):
+    """ This function reads the segment manifest of an index folder. A folder without a manifest holds a
+    single base segment
+    inputs:
+    index_folder - path of the index folder
+    outputs:
+    manifest - {"generation": int, "segments": [{"name": str, "deleted": [doc id,..]}, ..]}
+    """
+    try:
+        with open(os.path.join(index_folder, MANIFEST), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'generation': 0, 'segments': [{'name': BASE_SEGMENT, 'deleted': []}]}
+
+
+def hidden_ids(manifest):
+    """ This function returns, for every segment of the manifest, the ids hidden by the tombstones of the newer
+    segments
+    outputs:
+    output - [set of int page ids, ..] in manifest order
+    """
+    output = []
+    hidden = set()
+    for segment in reversed(manifest['segments']):
+        output.append(set(hidden))
+        hidden.update(segment['deleted'])
+    output.reverse()
+    return output
+
+
+def live_rows(segment, hidden):
+    # Rows of the doc table of a BinaryIndex whose documents are not hidden
+    return np.flatnonzero(~np.isin(segment.doc_ids, np.array(sorted(hidden), dtype=np.int64)))
+
+
+def live_doc_ids(segment, hidden):
+    # Sorted int ids of the documents of a BinaryIndex that are not hidden
+    return segment.doc_ids[live_rows(segment, hidden)]
+
+
+def write_manifest(index_folder, manifest):
+    """ This function replaces the manifest atomically, so readers see either the old or the new segment list
+    """
+    path = os.path.join(index_folder, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+@contextlib.contextmanager
+def index_lock(index_folder):
+    """ This function holds the lock of an index folder while a segment is added or merged, or the index is
+    rebuilt, so the threads and the processes that read, change and write back the manifest are serialized.
+    Unlike flock, the record lock on LOCK is not inherited by the worker processes forked meanwhile. fcntl
+    only exists on POSIX systems: on Windows the first byte of LOCK is locked with msvcrt instead
+    """
+    with THREAD_LOCK, open(os.path.join(index_folder, LOCK), 'a') as f:
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        if fcntl is not None:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+            yield
+            return
+        import msvcrt
+        f.seek(0)
+        while True:
+            try:
+                # LK_LOCK gives up after about 10 seconds, the lock is asked for again until it is free
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def reset_segments(index_folder):
+    """ This function removes the segments and the manifest left by incremental updates, before a full rebuild
+    """
+    path = os.path.join(index_folder, MANIFEST)
+    if not os.path.exists(path):
+        return
+    manifest = read_manifest(index_folder)
+    manifest['retired'] = [segment['name'] for segment in manifest['segments'] if segment['name'] != BASE_SEGMENT] + \
+        [name for name in manifest.get('retired', []) if name != BASE_SEGMENT]
+    remove_retired(index_folder, manifest)
+    os.remove(path)
+
+
+class SegmentedIndex:
+    """ Read-only view over the segments of an index folder that hides deleted and superseded documents.
+    It behaves like the JSON index: index[word] -> [{page_id:[[position,..],tf,tf_norm]},idf], with df and
+    idf computed over the live documents of all segments. Every live document is found by its segment and
+    its row in the doc table of that segment
+    """
+    def __init__(self, index_folder, cache_size=256):
+        self.index_folder = index_folder
+        manifest = read_manifest(index_folder)
+        self.generation = manifest['generation']
+        self.segments = [BinaryIndex(os.path.join(index_folder, segment['name']), cache_size=0)
+                         for segment in manifest['segments']]
+        # Documents of a segment are hidden by the tombstones of every newer segment
+        hidden = hidden_ids(manifest)
+        self.deleted = [frozenset(str(page_id) for page_id in ids) for ids in hidden]
+        self.hidden = [np.array(sorted(ids), dtype=np.int64) for ids in hidden]
+        rows = [live_rows(segment, ids) for segment, ids in zip(self.segments, hidden)]
+        doc_ids = np.concatenate([segment.doc_ids[segment_rows] for segment, segment_rows in zip(self.segments, rows)])
+        order = np.argsort(doc_ids, kind='stable')
+        self.live = doc_ids[order]
+        # Segment and doc table row of every live document, aligned with self.live
+        self.live_segments = np.repeat(np.arange(len(rows)), [len(segment_rows) for segment_rows in rows])[order]
+        self.live_rows = np.concatenate(rows)[order]
+        self.lengths = np.concatenate([segment.doc_lengths[segment_rows]
+                                       for segment, segment_rows in zip(self.segments, rows)])[order].astype(np.int64)
+        self.total_doc = len(self.live)
+        # Bitmap of the live documents, built by the first NOT query
+        self.live_bitmap = None
+        self.norm_array = None
+        self.cache = LRUCache(cache_size)
+
+    def doc_stats(self, norms=True):
+        """ Returns the statistics of the live documents as a DocStats view, {page_id: (length, norm)}. The norms
+        are only read with norms=True; otherwise they are None
+        """
+        return DocStats(self.live, self.lengths, self.norms() if norms else None)
+
+    def norms(self):
+        """ Returns the norm of the tf-idf vector of every live document as a float64 array aligned with
+        self.live. Every segment wrote the norms of its documents, with its own idf, when it was created or
+        merged: they are memory-mapped and gathered the first time they are asked for
+        """
+        if self.norm_array is None:
+            output = np.zeros(len(self.live))
+            for i, segment in enumerate(self.segments):
+                in_segment = self.live_segments == i
+                output[in_segment] = np.load(norms_path(segment.path), mmap_mode='r')[self.live_rows[in_segment]]
+            self.norm_array = output
+        return self.norm_array
+
+    def collection_stats(self):
+        """ Returns the statistics of the live documents: {"N", "total_tokens", "avg_doc_length"}
+        """
+        total_tokens = int(self.lengths.sum())
+        return {'N': self.total_doc,
+                'total_tokens': total_tokens,
+                'avg_doc_length': total_tokens / self.total_doc if self.total_doc else 0.0}
+
+    def live_doc_ids(self):
+        # Sorted int ids of the live documents
+        return self.live
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __iter__(self):
+        previous = None
+        for word in heapq.merge(*self.segments):
+            if word != previous and word in self:
+                yield word
+            previous = word
+
+    def keys(self):
+        return iter(self)
+
+    def get(self, word, default=None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+    def df(self, word):
+        """ Returns the number of postings of word in all segments, deleted documents included: an upper bound
+        of the live document frequency that needs no decoding
+        """
+        return sum(segment.df(word) for segment in self.segments)
+
+    def idf(self, word):
+        df = len(self.postings_arrays(word)[0])
+        if df == 0:
+            raise KeyError(word)
+        return -math.log(float(df) / self.total_doc)
+
+    def postings_arrays(self, word):
+        """ Returns the sorted doc ids and the tfs of the live postings of word as int64 arrays
+        """
+        doc_ids = []
+        tfs = []
+        for segment, hidden in zip(self.segments, self.hidden):
+            segment_ids, segment_tfs = segment.postings_arrays(word)
+            live = np.isin(segment_ids, hidden, invert=True)
+            doc_ids.append(segment_ids[live])
+            tfs.append(segment_tfs[live])
+        doc_ids = np.concatenate(doc_ids)
+        order = np.argsort(doc_ids, kind='stable')
+        return doc_ids[order], np.concatenate(tfs)[order]
+
+    def contains(self, word, doc_ids):
+        """ Returns a bool array, True for the doc ids (sorted int64 array) with a live posting of word
+        """
+        output = np.zeros(len(doc_ids), dtype=bool)
+        for segment, hidden in zip(self.segments, self.hidden):
+            output |= segment.contains(word, doc_ids) & np.isin(doc_ids, hidden, invert=True)
+        return output
+
+    def __getitem__(self, word):
+        entry = self.cache.get(word)
+        if entry is None:
+            postings = {}
+            for segment, deleted in zip(self.segments, self.deleted):
+                segment_entry = segment.get(word)
+                if segment_entry is None:
+                    continue
+                for page_id, posting in segment_entry[0].items():
+                    if page_id not in deleted:
+                        postings[page_id] = posting
+            if not postings:
+                raise KeyError(word)
+            idf = -math.log(float(len(postings)) / self.total_doc)
+            entry = [postings, idf]
+            self.cache.put(word, entry)
+        return entry
+
+
+class DocStats:
+    """ Read-only {page_id: (length, norm)} view of the live documents of a SegmentedIndex, over arrays aligned
+    with their sorted ids, so nothing is built per document when the index is opened
+    """
+    def __init__(self, doc_ids, lengths, norms=None):
+        self.doc_ids = doc_ids
+        self.lengths = lengths
+        self.norms = norms
+
+    def position(self, page_id):
+        # Row of a page id, -1 if it is not a live document
+        try:
+            doc_id = int(page_id)
+        except ValueError:
+            return -1
+        i = int(np.searchsorted(self.doc_ids, doc_id))
+        return i if i < len(self.doc_ids) and self.doc_ids[i] == doc_id else -1
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return (str(page_id) for page_id in self.doc_ids.tolist())
+
+    def __contains__(self, page_id):
+        return self.position(page_id) >= 0
+
+    def __getitem__(self, page_id):
+        i = self.position(page_id)
+        if i < 0:
+            raise KeyError(page_id)
+        return int(self.lengths[i]), float(self.norms[i]) if self.norms is not None else None
+
+    def get(self, page_id, default=None):
+        return self[page_id] if page_id in self else default
+
+    def items(self):
+        return ((page_id, self[page_id]) for page_id in self)
+
+    def values(self):
+        return (stats for page_id, stats in self.items())
+
+
+class TieredMergePolicy:
+    """ Log-structured merge policy. A segment's tier is the floor of the log (base merge_factor) of its live
+    document count; once merge_factor adjacent segments share a tier they are merged into one segment of the
+    next tier, smallest tier first. Only adjacent segments are merged, so tombstones keep their meaning
+    """
+    def __init__(self, merge_factor=4, floor_docs=64):
+        self.merge_factor = merge_factor
+        self.floor_docs = floor_docs
+
+    def tier(self, docs):
+        return int(math.log(max(docs, self.floor_docs) / self.floor_docs, self.merge_factor))
+
+    def find_merge(self, sizes):
+        """ This function picks the segments to merge
+        inputs:
+        sizes - live document count of every segment, oldest first
+        outputs:
+        output - (start, end) slice of the segments to merge, or None
+        """
+        tiers = [self.tier(docs) for docs in sizes]
+        best = None
+        start = 0
+        while start < len(tiers):
+            end = start
+            while end < len(tiers) and tiers[end] == tiers[start]:
+                end += 1
+            if end - start >= self.merge_factor and (best is None or tiers[start] < tiers[best[0]]):
+                best = (start, start + self.merge_factor)
+            start = end
+        return best
+
+
+def merge_locked(index_folder, start, end):
+    """ This function merges the adjacent segments [start, end) into one new segment, dropping the documents
+    hidden by tombstones and the tombstones that no older segment needs, then swaps it into the manifest
+    atomically. The caller holds the index lock
+    inputs:
+    index_folder - path of the index folder
+    start, end - slice of the manifest's segments to merge
+    outputs:
+    manifest - the new manifest
+    """
+    manifest = read_manifest(index_folder)
+    merged = manifest['segments'][start:end]
+    segments = [BinaryIndex(os.path.join(index_folder, segment['name']), cache_size=0) for segment in merged]
+    hidden = hidden_ids(manifest)[start:end]
+    deleted = [frozenset(str(page_id) for page_id in ids) for ids in hidden]
+
+    doc_lengths = {}
+    for segment, ids in zip(segments, hidden):
+        live = np.isin(segment.doc_ids, np.array(sorted(ids), dtype=np.int64), invert=True)
+        for page_id, length in zip(segment.doc_ids[live].tolist(), segment.doc_lengths[live].tolist()):
+            doc_lengths[str(page_id)] = length
+
+    def terms():
+        previous = None
+        for word in heapq.merge(*segments):
+            if word == previous:
+                continue
+            previous = word
+            postings = {}
+            for segment, segment_deleted in zip(segments, deleted):
+                entry = segment.get(word)
+                if entry is not None:
+                    for page_id, posting in entry[0].items():
+                        if page_id not in segment_deleted:
+                            postings[page_id] = posting[0]
+            if postings:
+                yield word, postings
+
+    # Tombstones only matter for the documents of older segments
+    older = set()
+    for segment in manifest['segments'][:start]:
+        older.update(BinaryIndex(os.path.join(index_folder, segment['name']), cache_size=0).doc_ids.tolist())
+    tombstones = set()
+    for segment in merged:
+        tombstones.update(segment['deleted'])
+
+    generation = manifest['generation'] + 1
+    name = segment_name(generation)
+    path = os.path.join(index_folder, name)
+    sq_norms = {}
+    with open(path + '.tmp', 'wb') as outfile:
+        write_binary_index(finalize_terms(terms(), doc_lengths, sq_norms), doc_lengths, outfile)
+    write_doc_stats(doc_stats_path(path), doc_lengths, sq_norms)
+    write_norms(norms_path(path), doc_lengths, sq_norms)
+    write_collection_stats(collection_stats_path(path), doc_lengths)
+    os.replace(path + '.tmp', path)
+
+    manifest = read_manifest(index_folder)
+    remove_retired(index_folder, manifest)
+    manifest['segments'][start:end] = [{'name': name, 'deleted': sorted(tombstones & older)}]
+    manifest['generation'] = generation
+    manifest['retired'] = [segment['name'] for segment in merged]
+    write_manifest(index_folder, manifest)
+    return manifest
+
+
+def merge_segments(index_folder, start, end):
+    """ This function merges the segments [start, end) of an index folder under its lock (see merge_locked)
+    """
+    with index_lock(index_folder):
+        return merge_locked(index_folder, start, end)
+
+
+def remove_retired(index_folder, manifest):
+    for name in manifest.get('retired', []):
+        path = os.path.join(index_folder, name)
+        for path in (path, doc_stats_path(path), norms_path(path), collection_stats_path(path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class MergeScheduler:
+    """ Merges the segments of an index folder until the policy finds nothing left to merge, in the calling
+    thread with run or in a background thread with start. Every merge is chosen and done under the index lock,
+    and updates can add segments between two merges. Readers are never blocked: they keep the segments they
+    opened and pick up the merged segment when they open the index folder again (see query.Searcher.refresh)
+    """
+    def __init__(self, index_folder, policy=None):
+        self.index_folder = index_folder
+        self.policy = policy if policy is not None else TieredMergePolicy()
+        self.thread = None
+        self.merges = 0
+
+    def segment_sizes(self):
+        manifest = read_manifest(self.index_folder)
+        sizes = []
+        for segment, ids in zip(manifest['segments'], hidden_ids(manifest)):
+            index = BinaryIndex(os.path.join(self.index_folder, segment['name']), cache_size=0)
+            sizes.append(len(live_doc_ids(index, ids)))
+        return sizes
+
+    def run(self):
+        while True:
+            with index_lock(self.index_folder):
+                found = self.policy.find_merge(self.segment_sizes())
+                if found is None:
+                    return
+                merge_locked(self.index_folder, found[0], found[1])
+            self.merges += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
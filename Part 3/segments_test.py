@@ -0,0 +1,181 @@
+import multiprocessing
+import os
+import sys
+import types
+import numpy as np
+import pytest
+from query import read_titles, open_index
+from update import update_index
+from postings import read_doc_stats
+from segments import read_manifest, reset_segments, index_lock, merge_segments, SegmentedIndex, TieredMergePolicy, \
+    MergeScheduler
+
+# Folder of the test collections, the tests that build an index run in a temporary folder
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+DELTA_XML = '''<collection>
+    <page><title>orange nemo</title><id>9</id><text>fish</text></page>
+    <page><title>finding nemo</title><id>20</id><text>clownfish</text></page>
+</collection>'''
+
+
+@pytest.fixture
+def base(build):
+    # Binary index of small.xml, with the delta collection next to it
+    stop = build('small.xml')
+    with open('delta.xml', 'w') as f:
+        f.write(DELTA_XML)
+    return stop
+
+
+def test_update_segment(base):
+    stop = base
+    manifest = update_index('delta.xml', stop, deleted=[0])
+    assert manifest['generation'] == 1
+    assert manifest['segments'][1] == {'name': 'seg_000001.bin', 'deleted': [0, 9, 20]}
+
+    index = open_index('index/')
+    assert isinstance(index, SegmentedIndex)
+    assert index.total_doc == 13 - 1 + 1
+    assert index.live_doc_ids().tolist() == list(range(1, 13)) + [20]
+    # Page 0 is deleted and page 9 was replaced
+    assert sorted(index['2001'][0]) == ['3']
+    assert sorted(index['clockwork'][0]) == ['10', '11', '12']
+    assert sorted(index['orang'][0]) == ['10', '9']
+    assert sorted(index['nemo'][0]) == ['20', '9']
+    assert 'clownfish' in index and 'zzz' not in index
+    assert index.contains('orang', np.array([0, 9, 10, 11, 20])).tolist() == [False, True, True, False, False]
+    # The norms of a document are the ones its segment wrote, read from the .norms.npy file of the segment
+    doc_stats = index.doc_stats()
+    base = read_doc_stats('index/myIndex.docstats')
+    delta = read_doc_stats('index/seg_000001.docstats')
+    assert list(doc_stats) == [str(page_id) for page_id in range(1, 13)] + ['20']
+    assert doc_stats['5'] == base['5'] and doc_stats['9'] == delta['9'] and '0' not in doc_stats
+    assert index.doc_stats(norms=False)['9'] == (delta['9'][0], None)
+    assert index.collection_stats()['total_tokens'] == sum(length for length, norm in doc_stats.values())
+    titles = read_titles('index/myTitles.dat')
+    assert '0' not in titles and titles['9'] == 'orange nemo' and titles['20'] == 'finding nemo'
+    # A page deleted and added again keeps the title of the delta
+    update_index('delta.xml', stop, deleted=[20])
+    assert read_titles('index/myTitles.dat')['20'] == 'finding nemo'
+    assert sorted(open_index('index/')['nemo'][0]) == ['20', '9']
+
+
+def test_update_json_index(build):
+    stop = build('small.xml', 'myIndex.dat')
+    with open('delta.xml', 'w') as f:
+        f.write(DELTA_XML)
+    with pytest.raises(ValueError):
+        update_index('delta.xml', stop, deleted=[])
+    assert sorted(os.listdir('index')) == ['myIndex.dat', 'myIndex.docstats', 'myIndex.stats.json', 'myTitles.dat']
+
+
+def test_delete_only_and_reset(base):
+    stop = base
+    with open('empty.xml', 'w') as f:
+        f.write('<collection></collection>')
+    update_index('empty.xml', stop, deleted=[3])
+    index = open_index('index/')
+    assert sorted(index['2001'][0]) == ['0']
+    assert sorted(index.keys()) == sorted(word for word in open_index('index/') if word in index)
+    reset_segments('index')
+    assert read_manifest('index')['segments'] == [{'name': 'myIndex.bin', 'deleted': []}]
+    assert sorted(os.listdir('index')) == ['myIndex.bin', 'myIndex.docstats', 'myIndex.norms.npy', 'myIndex.stats.json',
+                                           'myStems.dat', 'myTitles.dat', 'segments.lock']
+
+
+def test_tiered_merge_policy():
+    policy = TieredMergePolicy(merge_factor=3, floor_docs=10)
+    assert policy.find_merge([1000, 5, 8, 2]) == (1, 4)
+    assert policy.find_merge([1000, 5, 8]) is None
+    assert policy.find_merge([100, 120, 150, 5, 5]) == (0, 3)
+    assert policy.find_merge([100, 120, 150, 5, 5, 5]) == (3, 6)
+
+
+def test_merge_segments(base):
+    stop = base
+    update_index('delta.xml', stop, deleted=[0])
+    reader = open_index('index/')
+    expected = {word: reader[word] for word in reader}
+
+    scheduler = MergeScheduler('index', TieredMergePolicy(merge_factor=2))
+    scheduler.start()
+    scheduler.join()
+    assert scheduler.merges == 1
+    manifest = read_manifest('index')
+    assert manifest['segments'] == [{'name': 'seg_000002.bin', 'deleted': []}]
+    assert manifest['retired'] == ['myIndex.bin', 'seg_000001.bin']
+    # The reader opened before the merge still works, and opening the folder again picks up the merged segment
+    assert sorted(reader['2001'][0]) == ['3']
+    merged = open_index('index/')
+    assert len(merged.segments) == 1
+    assert {word: merged[word] for word in merged} == expected
+    assert merged.total_doc == 13
+    # The merged segment wrote its norms with the idf of all the documents
+    sq_norms = {}
+    for word in merged:
+        postings, idf = merged[word]
+        for page_id, posting in postings.items():
+            sq_norms[page_id] = sq_norms.get(page_id, 0.0) + (posting[1] * idf) ** 2
+    doc_stats = merged.doc_stats()
+    for page_id in doc_stats:
+        assert doc_stats[page_id][1] == pytest.approx(sq_norms.get(page_id, 0.0) ** 0.5)
+
+
+def test_index_lock_without_fcntl(tmp_path, monkeypatch):
+    # Without fcntl (Windows) the first byte of the lock file is locked with msvcrt, and a busy lock is retried
+    calls = []
+    def locking(fd, mode, nbytes):
+        calls.append(mode)
+        if len(calls) == 1:
+            raise OSError('locked')
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    monkeypatch.setitem(sys.modules, 'msvcrt', types.SimpleNamespace(LK_LOCK=1, LK_UNLCK=0, locking=locking))
+    with index_lock(str(tmp_path)):
+        assert calls == [1, 1]
+    assert calls == [1, 1, 0]
+
+
+def test_merge_waits_for_lock(base):
+    stop = base
+    update_index('delta.xml', stop, deleted=[0])
+    with index_lock('index'):
+        merger = multiprocessing.get_context('spawn').Process(target=merge_segments, args=('index', 0, 2))
+        merger.start()
+        merger.join(2)
+        # The other process waits for the lock before reading the manifest
+        assert merger.is_alive()
+        assert len(read_manifest('index')['segments']) == 2
+    merger.join()
+    assert merger.exitcode == 0
+    assert read_manifest('index')['segments'] == [{'name': 'seg_000002.bin', 'deleted': []}]
+
+
+def test_not_on_replaced_docs(build):
+    from query import rec, read_stopwords, Searcher
+    from create import write_scores
+    import boolparser
+    stopwords_path = os.path.join(FOLDER, 'stopwords.dat')
+    stopwords = read_stopwords(stopwords_path)
+    with open('base.xml', 'w') as f:
+        f.write('<collection><page><title>one</title><id>1</id><text>beta gamma</text></page>'
+                '<page><title>two</title><id>2</id><text>beta gamma</text></page>'
+                '<page><title>three</title><id>3</id><text>gamma</text></page></collection>')
+    with open('delta.xml', 'w') as f:
+        f.write('<collection><page><title>one</title><id>1</id><text>beta delta</text></page>'
+                '<page><title>two</title><id>2</id><text>beta delta</text></page></collection>')
+    stop = build('base.xml')
+    update_index('delta.xml', stop, deleted=[])
+    index = open_index('index/')
+    # The replaced postings of beta still count in its df, the complement of beta is not empty
+    assert index.df('beta') == 4 and index.total_doc == 3
+    assert list(rec(boolparser.bool_expr_ast('gamma AND NOT beta'), index, stopwords)) == [3]
+    assert list(rec(boolparser.bool_expr_ast('delta AND beta'), index, stopwords)) == [1, 2]
+    assert list(rec(boolparser.bool_expr_ast('delta OR NOT beta'), index, stopwords)) == [1, 2, 3]
+    write_scores({})
+    ranked, error = Searcher(stopwords_path, 'index/').search('gamma AND NOT beta')
+    assert [page_id for page_id, score in ranked] == ['3']
+    # BM25 only reads the document lengths, the norms are not loaded
+    searcher = Searcher(stopwords_path, 'index/', flag_rank='bm25')
+    assert [page_id for page_id, score in searcher.search('gamma')[0]] == ['3']
+    assert searcher.inverted_index.norm_array is None
@@ -1,6 +1,11 @@
 from query import *
 from create import *
 import pytest
+import link
+from postings import read_binary_index
+
+# Folder of the test collections, the tests that build an index run in a temporary folder
+FOLDER = os.path.dirname(os.path.abspath(__file__))
 
 stemmer = PorterStemmer()
 
@@ -58,12 +63,127 @@ def test_tf_idf3():
     assert get_doc_score(doc_matrix, inverted_index, matched_ids, q_word) == \
            [('0', 1.0), ('2', 1.0), ('3', 1.0), ('8', 1.0)]
 
+def test_tf_idf_top_k():
+    matched_ids = ['0','2','3','8']
+    q_word = ["2001", "space"]
+    doc_matrix = [[1, 1], [0, 1], [1, 1], [0, 1]]
+    assert get_doc_score(doc_matrix, inverted_index, matched_ids, q_word, k=2, offset=1) == \
+           [('3', 0.9751424258351847), ('2', 0.5328498146926454)]
+
+def test_plan_query(stopwords):
+    assert flatten_ast(('AND', [('AND', ['a', ('OR', ['b', ('OR', ['c', 'd'])])]), 'e'])) == \
+           ('AND', ['a', ('OR', ['b', 'c', 'd']), 'e'])
+    ast = boolparser.bool_expr_ast('space AND (kiss OR killer) AND clockwork AND odyssey')
+    plan = plan_query(ast, inverted_index, stopwords)
+    # AND operands are flattened and ordered by their estimated number of matches
+    assert [operand[1] if operand[0] == 'TERM' else operand[0] for operand in plan[1]] == \
+           ['odyssey', 'space', 'clockwork', 'OR']
+    assert plan[1][3][2] == 5 and plan[2] == 3
+    assert not run_plan(plan, inverted_index)
+    assert list(rec(boolparser.bool_expr_ast('(orange AND clockwork) OR 2001'), inverted_index, stopwords)) == \
+           [0, 3, 9, 10]
+    assert not rec(boolparser.bool_expr_ast('the AND space'), inverted_index, stopwords)
+    # Quoted operands are phrases
+    plan = plan_query(boolparser.bool_expr_ast('"clockwork orange" OR 2001'), inverted_index, stopwords)
+    assert plan[1][0] == ('PHRASE', ['clockwork', 'orang'], 2)
+    assert list(run_plan(plan, inverted_index)) == [0, 3, 9]
+    assert not rec(boolparser.bool_expr_ast('"orange clockwork" AND clockwork'), inverted_index, stopwords)
+
+def test_not_query(stopwords):
+    def match(q):
+        return list(rec(boolparser.bool_expr_ast(q), inverted_index, stopwords))
+    assert match('clockwork AND NOT orange') == [11, 12]
+    assert match('NOT clockwork') == list(range(9))
+    assert match('NOT (clockwork OR space) AND NOT kiss') == [1, 6, 7]
+    assert match('clockwork AND NOT NOT orange') == [9, 10]
+    assert match('kiss AND NOT the') == [4, 5]
+    # The documents of the index are collected once and the bitmap of a bare NOT is kept on the index
+    bitmap = inverted_index.live_bitmap
+    assert len(bitmap) == 13 and inverted_index.live_doc_ids().tolist() == list(range(13))
+    match('NOT kiss')
+    assert inverted_index.live_bitmap is bitmap
+    # a AND NOT b: the negated operand is subtracted last, never complemented
+    plan = plan_query(boolparser.bool_expr_ast('NOT orange AND clockwork'), inverted_index, stopwords)
+    assert plan == ('AND', [('TERM', 'clockwork', 4), ('NOT', [('TERM', 'orang', 2)], 11)], 4)
+    query_obj = QueryFactory.create('clockwork AND NOT (orange OR kiss)')
+    query_obj.remove()
+    assert query_obj.query_string == 'clockwork'
+
+def test_plan_short_circuit(stopwords, monkeypatch):
+    # Once an intersection is empty the remaining operands are not read
+    read = []
+    probed = []
+    def counting_postings(index, word):
+        read.append(word)
+        return postings_arrays(index, word)
+    def counting_contain(index, word, doc_ids):
+        probed.append((word, doc_ids.tolist()))
+        return postings_contain(index, word, doc_ids)
+    monkeypatch.setattr('query.postings_arrays', counting_postings)
+    monkeypatch.setattr('query.postings_contain', counting_contain)
+    ast = boolparser.bool_expr_ast('space AND orange AND clockwork')
+    assert not rec(ast, inverted_index, stopwords)
+    # Only the cheapest term is decoded, the next one is probed with its matches
+    assert read == ['orang'] and probed == [('space', [9, 10])]
+    # So is a negated term
+    del read[:], probed[:]
+    assert list(rec(boolparser.bool_expr_ast('clockwork AND NOT orange'), inverted_index, stopwords)) == [11, 12]
+    assert read == ['clockwork'] and probed == [('orang', [9, 10, 11, 12])]
+
+def test_match_phrase():
+    assert match_phrase([[1, 7, 12], [4, 8, 20], [9]]) == 7
+    assert match_phrase([[1, 7], [2, 9], [4, 10]]) == -1
+    # A repeated word walks the same list with its own pointer
+    assert match_phrase([[3, 4, 9], [3, 4, 9]]) == 3
+    assert match_phrase([[5], []]) == -1
+    assert compare([1, 5, 9], [2, 6, 7]) == [2, 6]
+    assert compare([1], []) == []
+
+def test_phrase_match(stopwords):
+    import copy
+    before = copy.deepcopy(inverted_index)
+    def match(q):
+        query_obj = QueryFactory.create(q)
+        query_obj.remove()
+        query_obj.lower_q()
+        query_obj.obtain_tokens()
+        query_obj.filter_tokens(stopwords)
+        query_obj.stem()
+        return query_obj.match(inverted_index)
+    assert match('"2001 space odyssey"') == ['0', '3']
+    assert match('"full metal jacket"') == ['3', '7']
+    assert match('"odyssey space"') == [' ']
+    assert match('"kiss"') == ['4', '5']
+    assert match('"zzz kiss"') == [' ']
+    # The position lists of the index are not modified
+    assert inverted_index == before
+
+def test_select_top_k():
+    scored = [(str(i), (i * 7) % 5) for i in range(20)]
+    assert select_top_k(scored) == sorted(scored, key=lambda tup: tup[1], reverse=True)
+    pages = [select_top_k(scored, 3, offset) for offset in range(0, 21, 3)]
+    assert sum(pages, []) == select_top_k(scored)
+    assert select_top_k(scored, 10, 25) == []
+
+def test_rank_scores():
+    scores = np.array([(i * 7) % 5 for i in range(20)], dtype=float)
+    ids = [str(i) for i in range(20)]
+    expected = select_top_k(list(zip(ids, scores.tolist())))
+    assert rank_scores(ids, scores) == expected
+    pages = [rank_scores(ids, scores, 3, offset) for offset in range(0, 21, 3)]
+    assert sum(pages, []) == expected
+    assert rank_scores(ids, scores, 10, 25) == []
+
 # test QueryFactory that find the type of queries
 def test_one_word():
     assert type(QueryFactory.create('oneword')).__name__ == 'OneWordQuery'
     assert type(QueryFactory.create('free text')).__name__ == 'FreeTextQuery'
     assert type(QueryFactory.create('"2001 space"')).__name__ == 'PhraseQuery'
     assert type(QueryFactory.create('2001 AND space')).__name__ == 'BooleanQuery'
+    assert type(QueryFactory.create('NOT space')).__name__ == 'BooleanQuery'
+    assert type(QueryFactory.create('"toy story" AND "mr potato"')).__name__ == 'BooleanQuery'
+    # Operators are whole words
+    assert type(QueryFactory.create('ORANGES NOTHING')).__name__ == 'FreeTextQuery'
     assert QueryFactory.create('')== None
 
 # check boolean bad input
@@ -172,4 +292,247 @@ def test_boolean_OR_small(index,stopwords):
     query_obj.stem()
     match_ids = [int(x) for x in match_ids]
     match_ids.sort()
-    assert match_ids == [0,2,3,7]
\ No newline at end of file
+    assert match_ids == [0,2,3,7]
+# Streaming ingestion
+def test_stream_collection(workdir):
+    pages = stream_collection(os.path.join(FOLDER, 'small.xml'), workdir, 'titles.dat')
+    assert not isinstance(pages, list)
+    create_invertedindex(pages, 'index.dat')
+    assert read_inverted_index(os.path.join('index', 'index.dat')) == inverted_index
+    assert read_titles(os.path.join('index', 'titles.dat')) == titles
+
+def test_stream_collection_workers(workdir):
+    collection = os.path.join(FOLDER, 'small2.xml')
+    stop = workdir
+    serial = list(stream_collection(collection, stop, 'titles.dat'))
+    pages = iter_pages(collection, 'titles.dat')
+    assert list(analyze_parallel(pages, stop, workers=2, batch_size=3)) == serial
+    assert list(stream_collection(collection, stop, 'titles.dat', workers=2)) == serial
+
+# Single pass over the collection for text and links
+LINKED_XML = '''<collection>
+    <page><title>Nemo</title><id>1</id><revision><text>clownfish [[Dory|friend]] [[Marlin]]</text></revision></page>
+    <page><title>Dory</title><id>2</id><revision><text>blue tang [[Nemo#Plot]]</text></revision></page>
+    <page><title>Marlin</title><id>3</id><revision><text>father</text></revision></page>
+    <page><title>Bruce</title><id>4</id><revision><text>shark</text></revision></page>
+</collection>'''
+
+def test_single_pass_links(workdir):
+    with open('linked.xml', 'w') as f:
+        f.write(LINKED_XML)
+    links = LinkCollector()
+    pages = list(stream_collection('linked.xml', workdir, 'titles.dat', links=links))
+    assert [page[0] for page in pages] == ['1', '2', '3', '4']
+    # Same graph as the two-pass parser of link.py
+    assert links.outlinks() == link.parse('linked.xml') == {1: [2, 3], 2: [1], 3: []}
+
+def test_rebuild_other_format(workdir, monkeypatch):
+    import create
+    stopwords_path, small, small2 = (os.path.join(FOLDER, name) for name in ('stopwords.dat', 'small.xml', 'small2.xml'))
+    monkeypatch.setattr(sys, 'argv', ['create.py', stopwords_path, small, 'index/'])
+    create.main()
+    assert isinstance(open_index('index/'), BinaryIndex)
+    monkeypatch.setattr(sys, 'argv', ['create.py', stopwords_path, small2, 'index/', '--format', 'json'])
+    create.main()
+    # The binary index of the previous build is removed, queries read the new JSON index
+    assert not os.path.exists(os.path.join('index', 'myIndex.bin'))
+    assert open_index('index/') == read_inverted_index(os.path.join('index', 'myIndex.dat'))
+
+# External-memory index construction
+def test_create_invertedindex_runs(build):
+    # A budget of one byte flushes a run after every page
+    build('small.xml', 'index.dat', 'titles.dat', memory_budget=1)
+    assert read_inverted_index(os.path.join('index', 'index.dat')) == inverted_index
+    # The temporary runs are removed once they are merged
+    assert sorted(os.listdir('index')) == ['index.dat', 'index.docstats', 'index.stats.json', 'titles.dat']
+
+def test_merge_runs_passes(build, monkeypatch):
+    import create
+    monkeypatch.setattr(create, 'MAX_RUNS', 2)
+    read_run = create.read_run
+    open_runs = []
+    def counted_read_run(path):
+        open_runs.append(path)
+        yield from read_run(path)
+        assert len(open_runs) <= 2
+        open_runs.remove(path)
+    monkeypatch.setattr(create, 'read_run', counted_read_run)
+    # 13 runs are merged into 7, 4 and then 2 runs
+    build('small.xml', 'index.dat', 'titles.dat', memory_budget=1)
+    assert read_inverted_index(os.path.join('index', 'index.dat')) == inverted_index
+    assert sorted(os.listdir('index')) == ['index.dat', 'index.docstats', 'index.stats.json', 'titles.dat']
+
+# Index-time document norms
+def test_doc_stats_cosine(build):
+    build()
+    index = open_index('index/')
+    doc_stats = open_doc_stats('index/')
+    # Doc 2 is "yuri gagarin first man orbit space hello"
+    norm = math.sqrt(sum((index[w][0]['2'][1] * index[w][1]) ** 2 for w in ['yuri', 'gagarin', 'first', 'man', 'orbit', 'space', 'hello']))
+    assert doc_stats['2'] == (7, pytest.approx(norm))
+    ranked = get_cosine_score(index, doc_stats, ['clockwork', 'orang'])
+    assert sorted(page_id for page_id, score in ranked) == ['10', '11', '12', '4', '5', '9']
+    scores = dict(ranked)
+    assert scores['9'] == ranked[0][1] and 0 < scores['11'] < scores['9'] <= 1
+    # A single-term query scores tf * idf / norm
+    one = dict(get_cosine_score(index, doc_stats, ['kiss']))
+    assert one['6'] == pytest.approx(index['kiss'][0]['6'][1] * index['kiss'][1] / doc_stats['6'][1])
+
+# BM25 ranking
+def test_bm25(build):
+    build()
+    index = open_index('index/')
+    doc_stats = open_doc_stats('index/')
+    collection_stats = open_collection_stats('index/')
+    assert collection_stats['N'] == 13
+    ranked = get_bm25_score(index, doc_stats, collection_stats, ['2001'], k1=1.5, b=0.5)
+    # "2001" occurs twice in doc 0 (length 12) and three times in doc 12 (length 8)
+    idf = math.log(1 + (13 - 3 + 0.5) / (3 + 0.5))
+    avg = collection_stats['avg_doc_length']
+    expected = idf * 3 * 2.5 / (3 + 1.5 * (0.5 + 0.5 * doc_stats['12'][0] / avg))
+    assert ranked[0] == ('12', pytest.approx(expected))
+    assert [page_id for page_id, score in ranked] == ['12', '0', '3']
+    # Only the matched ids are scored
+    assert [page_id for page_id, score in get_bm25_score(index, doc_stats, collection_stats, ['2001', 'kiss'], [3, 6])] == ['6', '3']
+
+
+@pytest.mark.parametrize('block_size', [128, 2])
+def test_bm25_top_k(build, monkeypatch, block_size):
+    import postings
+    monkeypatch.setattr(postings, 'BLOCK_SIZE', block_size)
+    build()
+    index = open_index('index/')
+    doc_stats = open_doc_stats('index/')
+    collection_stats = open_collection_stats('index/')
+    json_index = read_binary_index('index/myIndex.bin')
+    for q_word in (['2001'], ['2001', 'kiss', 'film'], ['film', 'film', 'space'], ['zzz', 'kiss']):
+        expected = get_bm25_score(index, doc_stats, collection_stats, q_word)[:3]
+        for inverted_index, k1 in ((index, 1.2), (index, 2.0), (json_index, 1.2)):
+            if k1 != 1.2:
+                expected_k1 = get_bm25_score(index, doc_stats, collection_stats, q_word, k1=k1)[:3]
+            else:
+                expected_k1 = expected
+            for block_max in (False, True):
+                ranked = get_bm25_top_k(inverted_index, doc_stats, collection_stats, q_word, 3, k1=k1,
+                                        block_max=block_max)
+                assert [page_id for page_id, score in ranked] == [page_id for page_id, score in expected_k1]
+                assert [score for page_id, score in ranked] == \
+                    pytest.approx([score for page_id, score in expected_k1])
+
+
+def test_tfidf_score(build):
+    build()
+    index = open_index('index/')
+    doc_stats = open_doc_stats('index/')
+    json_index = read_binary_index('index/myIndex.bin')
+    for q_word in (['2001', 'space'], ['kiss', 'film', 'kiss', 'zzz'], ['space']):
+        match_ids = sorted(int(page_id) for page_id in FreeTextQuery(q_word).match(json_index) if page_id != ' ')
+        unmatched = min(set(int(page_id) for page_id in doc_stats) - set(match_ids))
+        match_ids.append(unmatched)
+        for inverted_index in (index, json_index):
+            assert get_tfidf_score(inverted_index, q_word, match_ids, doc_stats) == \
+                get_cosine_score(json_index, doc_stats, q_word, match_ids)
+        # The unmatched document has no query term, its norm over the query columns is 0
+        expected = get_doc_score(get_tf_matrix(match_ids[:-1], json_index, q_word), json_index, match_ids[:-1], q_word)
+        ranked = get_tfidf_score(index, q_word, match_ids)
+        assert ranked[:-1] == [(str(page_id), score) for page_id, score in expected]
+        assert ranked[-1] == (str(unmatched), 0.0)
+        assert get_tfidf_score(index, q_word, match_ids, doc_stats, k=2, offset=1) == \
+            get_cosine_score(json_index, doc_stats, q_word, match_ids)[1:3]
+    assert get_tfidf_score(index, ['space'], []) == []
+
+
+def test_batch_queries(build, monkeypatch):
+    options = {'stopwords_path': os.path.join(FOLDER, 'stopwords.dat'), 'index_folder': 'index/', 'top_k': 3}
+    build()
+    write_scores({})
+    queries = ['2001 space', 'kiss', '', 'the', '"space odyssey"', '(film AND space)', 'zzz']
+    searcher = Searcher(**options)
+    for workers in (1, 2):
+        times, cached = run_batch(queries, 'results.jsonl', options, workers)
+        with open('results.jsonl') as f:
+            results = [json.loads(line) for line in f]
+        assert len(times) == len(results) == len(queries)
+        for q, result in zip(queries, results):
+            ranked, error = searcher.search(q)
+            assert result['query'] == q and result['error'] == error
+            assert result['ids'] == [page_id for page_id, score in ranked]
+            assert result['scores'] == [score for page_id, score in ranked]
+            assert not result['cached']
+    assert results[2]['error'] is not None and results[3]['error'] is not None
+    assert len(results[0]['ids']) == 3 and results[6]['ids'] == []
+    # The command line loads the index once: in this process for a single worker, only in the workers otherwise
+    import query
+    loads = []
+    load = Searcher.load
+    def counting_load(self):
+        loads.append(self)
+        load(self)
+    monkeypatch.setattr(Searcher, 'load', counting_load)
+    with open('queries.txt', 'w') as f:
+        f.write('\n'.join(queries[:2]) + '\n')
+    argv = ['query.py', options['stopwords_path'], 'index/', '--top-k', '3', '--queries', 'queries.txt', '--output',
+            'main.jsonl']
+    monkeypatch.setattr(sys, 'argv', argv)
+    query.main()
+    assert len(loads) == 1 and query.worker_searcher is loads[0]
+    monkeypatch.setattr(sys, 'argv', argv + ['--workers', '2'])
+    query.main()
+    assert len(loads) == 1
+    with open('main.jsonl') as f:
+        assert [json.loads(line)['ids'] for line in f] == [result['ids'] for result in results[:2]]
+
+
+def test_result_cache(build):
+    from update import update_index
+    stop = build('small.xml')
+    write_scores({})
+    searcher_stopwords = os.path.join(FOLDER, 'stopwords.dat')
+    searcher = Searcher(searcher_stopwords, 'index/', cache_size=2)
+    ranked, error = searcher.search('clockwork orange')
+    # Same tokens after normalization
+    assert searcher.search('Clockwork  Oranges!') == (ranked, None)
+    assert searcher.search('the clockwork orange') == (ranked, None)
+    assert (searcher.results.hits, searcher.results.misses) == (2, 1)
+    # A phrase or a Boolean query with the same tokens is a different query
+    searcher.search('"clockwork orange"')
+    searcher.search('(clockwork OR orange)')
+    searcher.search('(clockwork AND orange)')
+    assert (searcher.results.hits, searcher.results.misses) == (2, 4)
+    assert len(searcher.results) == 2
+    ranked, error = searcher.search('(clockwork AND) orange')
+    assert ranked == [] and error.startswith('ERROR: Invalid Boolean Query')
+
+    with open('delta.xml', 'w') as f:
+        f.write('<collection><page><title>clockwork orange</title><id>30</id><text>kubrick</text></page></collection>')
+    update_index('delta.xml', stop, deleted=[])
+    searcher.search('(clockwork AND orange)')
+    assert len(searcher.results) == 1 and searcher.results.misses == 5
+    assert '30' in [page_id for page_id, score in searcher.search('clockwork orange')[0]]
+    # The titles are reloaded with the index
+    assert searcher.titles['30'] == 'clockwork orange'
+    # Boolean queries are keyed on their normalized plan
+    assert searcher.search('Oranges AND (clockwork)')[0] == searcher.search('(clockwork AND orange)')[0]
+    assert searcher.results.hits == 4
+
+    # A full rebuild removes the manifest and replaces the base index
+    from segments import reset_segments
+    with open('rebuilt.xml', 'w') as f:
+        f.write('<collection><page><title>clockwork orange</title><id>40</id><text>burgess</text></page></collection>')
+    reset_segments('index')
+    build('rebuilt.xml')
+    assert [page_id for page_id, score in searcher.search('clockwork orange')[0]] == ['40']
+    assert searcher.titles == {'40': 'clockwork orange'}
+
+    # The document-term matrix is used while the index has one segment
+    from matrix import write_csr_matrix
+    write_csr_matrix(open_index('index/'), 'index/' + MATRIX)
+    searcher = Searcher(searcher_stopwords, 'index/', csr=True)
+    assert searcher.matrix is not None
+    update_index('delta.xml', stop, deleted=[])
+    searcher.search('clockwork orange')
+    assert searcher.matrix is None
+    reset_segments('index')
+    build('rebuilt.xml')
+    searcher.search('clockwork orange')
+    assert searcher.matrix is not None
@@ -0,0 +1,120 @@
+import argparse
+import os
+from create import read_stopwords2, stream_collection, create_invertedindex, stem_cache
+from segments import read_manifest, write_manifest, segment_name, index_lock, MergeScheduler
+
+###################### Read deleted ids ########################################
+def read_deleted(deleted_path):
+    """ This function reads the ids of deleted pages, one per line
+    inputs:
+    deleted_path - Path of the deleted ids file as a string (None if nothing is deleted)
+    outputs:
+    output - list of page ids as int
+    """
+    if deleted_path is None:
+        return []
+    with open(deleted_path, "r") as f:
+        return [int(line) for line in f if line.strip()]
+###################### Update titles ###########################################
+def read_titles_into(titles_path,output):
+    # Adds the "page_id title" lines of a titles file to output, if the file exists
+    if os.path.exists(titles_path):
+        with open(titles_path, "r") as f:
+            for line in f:
+                split_line = line.rstrip('\n').split(None, 1)
+                if len(split_line) == 2:
+                    output[split_line[0]] = split_line[1]
+
+def update_titles(titles_path,delta_titles_path,deleted):
+    """ This function rewrites the titles file without the deleted pages and with the titles of the delta pages.
+    A page that is deleted and in the delta is replaced, so deletions are applied first
+    inputs:
+    titles_path - Path of the titles file of the index
+    delta_titles_path - Path of the titles file written for the delta
+    deleted - list of deleted page ids
+    """
+    output = {}
+    read_titles_into(titles_path, output)
+    for page_id in deleted:
+        output.pop(str(page_id), None)
+    read_titles_into(delta_titles_path, output)
+    with open(titles_path + '.tmp', "w") as f:
+        for page_id, title in output.items():
+            f.write(page_id + ' ' + title + '\n')
+    os.replace(titles_path + '.tmp', titles_path)
+    os.remove(delta_titles_path)
+###################### Add a segment ###########################################
+def update_index(delta_path,stopwords_dict,deleted,workers=1):
+    """ This function indexes new and changed pages into a new segment of the index folder. The segment carries
+    tombstones for the deleted pages and for the older versions of the pages it contains, and the manifest is
+    swapped in last, so running queries keep using the previous segments until then. The index lock is held
+    throughout, so merges of other processes wait for the new segment
+    inputs:
+    delta_path - Path of the xml file with the new and changed pages
+    stopwords_dict - dictionary of stopwords
+    deleted - list of deleted page ids
+    workers - number of processes used to tokenize and stem the pages
+    outputs:
+    manifest - the new manifest
+    """
+    if not os.path.exists(os.path.join("index", read_manifest("index")['segments'][0]['name'])):
+        raise ValueError("Segments can only be added to a binary index, rebuild index/ with create.py --format binary")
+    with index_lock("index"):
+        manifest = read_manifest("index")
+        generation = manifest['generation'] + 1
+        name = segment_name(generation)
+        delta_titles = name.replace('.bin', '.titles')
+
+        # The stems of the index are kept with the ones of the delta
+        stems = os.path.join("index", 'myStems.dat')
+        if os.path.exists(stems):
+            stem_cache.load(stems)
+
+        updated = []
+        def pages():
+            for page in stream_collection(delta_path,stopwords_dict,delta_titles,workers):
+                updated.append(int(page[0]))
+                yield page
+        create_invertedindex(pages(),name,index_format='binary')
+
+        update_titles(os.path.join("index", 'myTitles.dat'), os.path.join("index", delta_titles), deleted)
+        stem_cache.save(stems)
+
+        tombstones = sorted(set(updated) | set(deleted))
+        manifest['segments'].append({'name': name, 'deleted': tombstones})
+        manifest['generation'] = generation
+        write_manifest("index", manifest)
+    return manifest
+
+def main():
+    # Create ArgumentParser object
+    parser = argparse.ArgumentParser(description='Add new, changed and deleted pages to an existing index')
+
+    #Add input and output filepaths
+    parser.add_argument('my_stopwords', help='Path to stopwords dat file')
+    parser.add_argument('my_delta', help='Path to xml file of the new and changed pages')
+    parser.add_argument('--deleted', dest='deleted', help='Path to file of deleted page ids, one per line')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to tokenize and stem pages')
+    parser.add_argument('--no-merge', dest='merge', action='store_false',
+                        help='Do not merge segments after the update (merging runs before update.py exits; queries '
+                             'of other processes keep reading the current segments meanwhile)')
+    args = parser.parse_args()
+
+    print("~ Stopwords path: {}".format(args.my_stopwords))
+    print("~ Delta path: {}".format(args.my_delta))
+
+    stopwords = read_stopwords2(args.my_stopwords)
+    deleted = read_deleted(args.deleted)
+    try:
+        manifest = update_index(args.my_delta,stopwords,deleted,args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    print("~ Segments: {}".format(len(manifest['segments'])))
+    if args.merge:
+        # Merges run here, before exiting; queries of other processes keep reading the current segments
+        scheduler = MergeScheduler("index")
+        scheduler.run()
+        print("~ Merges: {}, segments: {}".format(scheduler.merges, len(read_manifest("index")['segments'])))
+
+if __name__ == '__main__':
+    main()